@@ -0,0 +1,142 @@
+import itertools
+import os
+import re
+import time
+
+# 暂存的临时文件名：.{目标文件名}.tmp-{进程号}-{序号}
+TEMP_FILE_PATTERN = re.compile(r'^\..+\.tmp-\d+-\d+$')
+# 超过该时间（秒）仍未发布的临时文件视为崩溃遗留
+STALE_TEMP_AGE = 24 * 3600
+
+class WriteBatch:
+    """
+    暂存一批文件写入，commit时统一落盘并原子发布
+    每个文件先写入目标目录下的临时文件，commit时依次fsync临时文件并rename到目标路径，
+    最后对涉及的目录各fsync一次；未提交（或写到一半崩溃）的文件不会出现在目标路径上
+    放弃或提交失败时删除未发布的临时文件，以及暂存时新建、最终没有发布任何文件的目录
+    """
+    def __init__(self):
+        self._staged = []  # [(临时文件, 目标文件, 暂存时新建的最上层目录或None)]
+        self._counter = itertools.count()  # 临时文件序号，允许多个线程向同一批次暂存
+
+    def write_text(self, path, content, append=False):
+        """暂存文本文件，append为True时在现有内容后追加（整体重写后原子替换）"""
+        directory = os.path.dirname(path) or '.'
+        created = None
+        parent = directory
+        while parent and not os.path.isdir(parent):
+            created, parent = parent, os.path.dirname(parent)
+        os.makedirs(directory, exist_ok=True)
+
+        if append and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                content = f.read() + content
+
+        temp_file = os.path.join(directory, f".{os.path.basename(path)}.tmp-{os.getpid()}-{next(self._counter)}")
+        with open(temp_file, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+        self._staged.append((temp_file, path, created))
+        return path
+
+    def pending(self):
+        """返回尚未提交的暂存文件列表，可交给其他进程中的WriteBatch提交"""
+        return list(self._staged)
+
+    def adopt(self, staged):
+        """接管其他WriteBatch暂存的文件"""
+        self._staged.extend(staged)
+
+    def commit(self):
+        """fsync所有暂存文件后原子发布，再对目标目录各fsync一次"""
+        directories = set()
+        published = 0
+        try:
+            for temp_file, _, _ in self._staged:
+                fd = os.open(temp_file, os.O_RDWR)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+            for temp_file, path, _ in self._staged:
+                os.replace(temp_file, path)
+                directories.add(os.path.dirname(path) or '.')
+                published += 1
+        except Exception:
+            # 已发布的文件保留，其余暂存文件和空目录清理掉
+            self._staged = self._staged[published:]
+            self.discard()
+            raise
+        self._staged = []
+
+        for directory in directories:
+            fsync_directory(directory)
+
+    def discard(self):
+        """删除所有暂存文件，以及暂存时新建且现在为空的目录"""
+        for temp_file, path, created in self._staged:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            if created is not None:
+                _remove_empty_dirs(os.path.dirname(path), created)
+        self._staged = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+def _remove_empty_dirs(directory, top):
+    """从directory向上删除空目录，直到top（含）为止，遇到非空目录停止"""
+    while True:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return
+        if os.path.normpath(directory) == os.path.normpath(top):
+            return
+        directory = os.path.dirname(directory)
+
+def clean_stale_temp_files(root, max_age=STALE_TEMP_AGE):
+    """
+    删除root下崩溃遗留的临时文件（修改时间早于max_age秒前），
+    以及因此变空的目录（写入中途崩溃留下的时间戳目录），返回删除的临时文件数量
+    """
+    removed = 0
+    deadline = time.time() - max_age
+    for directory, _, filenames in os.walk(root, topdown=False):
+        stale = False
+        for filename in filenames:
+            if not TEMP_FILE_PATTERN.match(filename):
+                continue
+            temp_file = os.path.join(directory, filename)
+            try:
+                if os.path.getmtime(temp_file) < deadline:
+                    os.remove(temp_file)
+                    removed += 1
+                    stale = True
+            except OSError:
+                continue
+        if stale:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+    return removed
+
+def fsync_directory(directory):
+    """fsync目录使rename持久化，不支持目录fsync的平台（Windows）上跳过"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
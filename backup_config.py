@@ -1,24 +1,73 @@
-import paramiko
 import time
-import socket
 import os
 import datetime
+import contextlib
 import csv
 import re
-import filecmp
-import glob
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
+import queue
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-def get_config(hostname, username, password, port, command, timeout=120, device_type=None, device_name=None):
-    """为每个命令创建新的SSH连接并执行命令，改进分页处理"""
-    device_info = f"{device_name}({hostname})" if device_name else hostname
-    print(f"设备 {device_info} - 执行命令: {command}")
+import config_blame
+import profiling
+import state_capture
+from atomic_write import WriteBatch
+
+# 流水线参数：I/O阶段（SSH抓取）线程数、CPU阶段（清理/比较/写入）进程数、阶段之间的队列长度
+FETCH_WORKERS = 8
+CPU_WORKERS = os.cpu_count() or 2
+PIPELINE_QUEUE_SIZE = 16
+# 抓取到的配置先写入暂存目录，再把路径交给子进程，避免大文本经进程管道序列化复制
+SPOOL_DIR = os.path.join("backups", ".spool")
+SPOOL_STALE_SECONDS = 3600  # 超过该时间仍未被读取的暂存文件视为崩溃遗留
+
+CONFIG_COMMANDS = {
+    'running': 'display current-configuration',
+    'startup': 'display saved-configuration',
+}
+CONFIG_TYPE_LABELS = {
+    'running': '运行配置',
+    'startup': '启动配置',
+}
+# startup_fetch列为sftp/scp时直接下载设备上的启动配置文件，startup_file列可覆盖默认路径
+STARTUP_FILES = {
+    'huawei': 'vrpcfg.zip',
+    'h3c': 'startup.cfg',
+}
+# 输出最后一行是设备提示符（<sw>、[sw]或sw#），华为配置中单独的#分隔行不是提示符
+PROMPT_LINE_PATTERN = re.compile(r'(?:^|\n)\s*(<[^<>\r\n]+>|\[[^\[\]\r\n]+\]|[\w.\-/:()@]+[#>])\s*$')
+PROMPT_QUIET_SECONDS = 0.3  # 通道无新数据超过该时间才认为上一条命令的输出已读完
+PROMPT_SYNC_SECONDS = 30  # 等待提示符的最长时间
+# 华三设备输出中的光标控制字符
+CONTROL_SEQUENCE_PATTERN = re.compile(r'\[\d+D\s*\[\d+D')
+# 记录上次下载的启动配置文件大小和修改时间，保存在 backups/<设备>/startup/ 下
+REMOTE_STATE_FILE = ".remote_state.json"
+# 配置比较结果缓存，按 (两份配置的哈希, 清理规则版本) 记录比较结果，保存在 backups/<设备>/diff/ 下
+COMPARE_CACHE_FILE = ".compare_cache.json"
+COMPARE_CACHE_SIZE = 16
+# clean_config的清理规则变化时递增，使缓存的比较结果失效
+COMPARE_NORMALIZER_VERSION = 1
+
+def connect_device(hostname, username, password, port, via=None):
+    """创建并返回已认证的SSH客户端，via指定跳板机名称时经跳板机的共享连接建立通道"""
+    if via:
+        from jump_host import get_bastion
+        
+        return get_bastion(via).connect(hostname, username, password, port)
+    
+    # paramiko导入较慢，只在真正需要连接设备时导入
+    import paramiko
     
-    # 创建新的SSH客户端
     ssh_client = paramiko.SSHClient()
     ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    
     try:
-        # 连接到设备
         ssh_client.connect(
             hostname, 
             port=port,
@@ -28,6 +77,34 @@ def get_config(hostname, username, password, port, command, timeout=120, device_
             allow_agent=False,
             look_for_keys=False
         )
+    except Exception:
+        ssh_client.close()
+        raise
+    return ssh_client
+
+def get_config(hostname, username, password, port, command, timeout=120, device_type=None, device_name=None, ssh_pool=None,
+               via=None):
+    """
+    执行命令并返回输出，改进分页处理
+    未提供ssh_pool时为每个命令创建新的SSH连接，提供时复用连接池中的会话
+    """
+    return get_command_outputs(hostname, username, password, port, [command], timeout, device_type, device_name,
+                               ssh_pool, via)[command]
+
+def get_command_outputs(hostname, username, password, port, commands, timeout=120, device_type=None, device_name=None,
+                        ssh_pool=None, via=None):
+    """
+    在同一个交互会话中依次执行多条命令，只禁用一次分页，返回 {命令: 输出}
+    """
+    device_info = f"{device_name}({hostname})" if device_name else hostname
+    
+    ssh_client = None
+    try:
+        # 连接到设备（或从连接池取出已建立的会话）
+        if ssh_pool is not None:
+            ssh_client = ssh_pool.get(hostname, username, password, port, via)
+        else:
+            ssh_client = connect_device(hostname, username, password, port, via)
         
         # 创建一个新的通道
         channel = ssh_client.invoke_shell()
@@ -53,108 +130,152 @@ def get_config(hostname, username, password, port, command, timeout=120, device_
             channel.send('screen-length disable\n')
         
         time.sleep(2)
-        if channel.recv_ready():
-            channel.recv(4096)
-        
-        # 发送命令
-        channel.send(command + '\n')
-        time.sleep(2)  # 给设备一些响应时间
         
-        # 接收输出
-        output = ""
-        max_wait_cycles = 5  # 增加最大等待周期
-        wait_cycles = 0
-        last_output_length = 0  # 记录上次输出长度
-        same_length_count = 0   # 记录输出长度不变的次数
+        outputs = {}
+        previous = ""
+        for command in commands:
+            # 同一会话中上一条命令未读完的输出会混入下一条命令，发送前先同步到提示符
+            sync_to_prompt(channel, device_info, previous)
+            previous = outputs[command] = read_command_output(channel, command, device_info)
         
-        while True:
-            if channel.recv_ready():
-                chunk = channel.recv(4096).decode('utf-8', errors='ignore')
-                output += chunk
-                print(f"设备 {device_info} - 接收到 {len(chunk)} 字节数据")
-                wait_cycles = 0  # 重置等待周期
-                
-                # 检查是否有分页提示，如果有则发送空格继续
-                if ' ---- More ----' in chunk or '--More--' in chunk or '  ---- More ----' in chunk:
-                    print(f"设备 {device_info} - 检测到分页提示，发送空格继续...")
-                    channel.send(' ')
-                    time.sleep(1.5)  # 增加等待时间，确保设备有足够时间处理
-                
-                # 如果接收到命令提示符，表示命令执行完毕
-                if ('#' in chunk or '>' in chunk) and len(chunk.strip()) > 1 and command not in chunk:
-                    # 确保这不是命令回显
-                    if not any(cmd_part in chunk for cmd_part in command.split()):
-                        break
-                
-                # 检查输出长度是否变化
-                if len(output) == last_output_length:
-                    same_length_count += 1
-                else:
-                    same_length_count = 0
-                    last_output_length = len(output)
-                
-                # 如果连续多次输出长度不变，可能是卡在了某个状态
-                if same_length_count >= 5:
-                    print(f"设备 {device_info} - 检测到输出长度不变，尝试发送回车...")
-                    channel.send('\n')
-                    time.sleep(1)
-                    same_length_count = 0
-            else:
-                # 如果没有更多数据，等待一下再检查
-                time.sleep(1)
-                wait_cycles += 1
-                
-                # 如果等待超过最大周期，检查是否已经有完整输出
-                if wait_cycles >= max_wait_cycles:
-                    # 检查是否有命令提示符，如果有则可能已经完成
-                    if '#' in output or '>' in output:
-                        print(f"设备 {device_info} - 达到最大等待周期，检测到命令提示符，结束接收")
-                        break
-                    else:
-                        # 尝试发送回车，看是否能触发更多输出
-                        print(f"设备 {device_info} - 达到最大等待周期，发送回车...")
-                        channel.send('\n')
-                        time.sleep(1)
-                        wait_cycles = 0  # 重置等待周期
-        
-        # 清理输出中的分页标记和控制字符
-        output = output.replace(' ---- More ----', '').replace('--More--', '').replace('  ---- More ----', '')
-        # 清理华三设备特有的控制字符
-        output = re.sub(r'\[\d+D\s*\[\d+D', '', output)
-        
-        # 关闭通道和连接
+        # 关闭通道，连接池中的会话归还后保留给下次使用
         channel.close()
-        ssh_client.close()
-        return output
+        if ssh_pool is not None:
+            ssh_pool.release(hostname, username, port)
+        else:
+            ssh_client.close()
+        return outputs
         
     except Exception as e:
         print(f"设备 {device_info} - 命令执行错误: {str(e)}")
-        ssh_client.close()
+        if ssh_pool is not None:
+            ssh_pool.discard(hostname, username, port)
+        elif ssh_client is not None:
+            ssh_client.close()
         raise
 
-def compare_configs(running_config, startup_config):
-    # 比较运行配置和已保存配置
-    # 清理配置文本，移除提示符和分页标记
-    def clean_config(config):
-        lines = []
-        for line in config.splitlines():
-            # 移除分页标记和提示符
-            line = line.replace(' ---- More ----', '').replace('--More--', '')
-            # 移除控制字符
-            line = re.sub(r'\[\d+D\s*\[\d+D', '', line)
-            # 移除命令提示符和命令本身
-            if not (line.strip().startswith('<') or line.strip().endswith('#') or line.strip().endswith('>')):
-                # 移除命令行
-                if not ('display' in line and 'configuration' in line):
-                    # 忽略以 Info: 开头的行
-                    if not line.strip().startswith('Info:'):
-                        if line.strip():  # 只添加非空行
-                            lines.append(line.strip())
-        return lines
-    
-    running_lines = clean_config(running_config)
-    startup_lines = clean_config(startup_config)
+def ends_with_prompt(output):
+    """输出的最后一行是否为设备提示符"""
+    return PROMPT_LINE_PATTERN.search(output) is not None
+
+def sync_to_prompt(channel, device_info, output=""):
+    """
+    丢弃通道中遗留的输出，直到通道安静且最后一行是设备提示符
+    :param output: 上一条命令已读取的输出，以提示符结尾且通道安静时无需再等待
+    """
+    deadline = time.monotonic() + PROMPT_SYNC_SECONDS
+    quiet_since = time.monotonic()
+    prompted = False
+    while time.monotonic() < deadline:
+        if channel.recv_ready():
+            chunk = channel.recv(4096).decode('utf-8', errors='ignore')
+            output += chunk
+            print(f"设备 {device_info} - 丢弃上一条命令遗留的 {len(chunk)} 字节数据")
+            quiet_since = time.monotonic()
+            continue
+        if time.monotonic() - quiet_since < PROMPT_QUIET_SECONDS:
+            time.sleep(0.05)
+            continue
+        if ends_with_prompt(output):
+            return
+        if not prompted:
+            # 通道已安静但没有提示符，发送回车让设备重新输出提示符
+            channel.send('\n')
+            prompted = True
+            quiet_since = time.monotonic()
+            continue
+        time.sleep(0.05)
+    print(f"设备 {device_info} - 等待命令提示符超时，继续执行")
+
+def read_command_output(channel, command, device_info):
+    """在已禁用分页的交互通道中执行一条命令，读取到命令提示符为止"""
+    print(f"设备 {device_info} - 执行命令: {command}")
+    # 发送命令
+    channel.send(command + '\n')
+    time.sleep(2)  # 给设备一些响应时间
+    
+    # 接收输出
+    output = ""
+    max_wait_cycles = 5  # 增加最大等待周期
+    wait_cycles = 0
+    last_output_length = 0  # 记录上次输出长度
+    same_length_count = 0   # 记录输出长度不变的次数
+    
+    while True:
+        if channel.recv_ready():
+            chunk = channel.recv(4096).decode('utf-8', errors='ignore')
+            output += chunk
+            print(f"设备 {device_info} - 接收到 {len(chunk)} 字节数据")
+            wait_cycles = 0  # 重置等待周期
+            
+            # 检查是否有分页提示，如果有则发送空格继续
+            if ' ---- More ----' in chunk or '--More--' in chunk or '  ---- More ----' in chunk:
+                print(f"设备 {device_info} - 检测到分页提示，发送空格继续...")
+                channel.send(' ')
+                time.sleep(1.5)  # 增加等待时间，确保设备有足够时间处理
+            
+            # 输出以命令提示符结尾，表示命令执行完毕（命令回显行以提示符开头，不会匹配）
+            if ends_with_prompt(output):
+                break
+            
+            # 检查输出长度是否变化
+            if len(output) == last_output_length:
+                same_length_count += 1
+            else:
+                same_length_count = 0
+                last_output_length = len(output)
+            
+            # 如果连续多次输出长度不变，可能是卡在了某个状态
+            if same_length_count >= 5:
+                print(f"设备 {device_info} - 检测到输出长度不变，尝试发送回车...")
+                channel.send('\n')
+                time.sleep(1)
+                same_length_count = 0
+        else:
+            # 如果没有更多数据，等待一下再检查
+            time.sleep(1)
+            wait_cycles += 1
+            
+            # 如果等待超过最大周期，检查是否已经有完整输出
+            if wait_cycles >= max_wait_cycles:
+                # 检查是否有命令提示符，如果有则可能已经完成
+                if '#' in output or '>' in output:
+                    print(f"设备 {device_info} - 达到最大等待周期，检测到命令提示符，结束接收")
+                    break
+                else:
+                    # 尝试发送回车，看是否能触发更多输出
+                    print(f"设备 {device_info} - 达到最大等待周期，发送回车...")
+                    channel.send('\n')
+                    time.sleep(1)
+                    wait_cycles = 0  # 重置等待周期
     
+    # 清理输出中的分页标记和控制字符
+    output = output.replace(' ---- More ----', '').replace('--More--', '').replace('  ---- More ----', '')
+    # 清理华三设备特有的控制字符
+    output = re.sub(r'\[\d+D\s*\[\d+D', '', output)
+    return output
+
+def clean_config(config):
+    """清理配置文本，移除提示符和分页标记，返回非空配置行列表"""
+    lines = []
+    for line in config.splitlines():
+        # 移除分页标记和提示符
+        line = line.replace(' ---- More ----', '').replace('--More--', '')
+        # 移除控制字符（只有含'['的行才可能包含）
+        if '[' in line:
+            line = CONTROL_SEQUENCE_PATTERN.sub('', line)
+        stripped = line.strip()
+        # 只添加非空行，移除命令提示符和命令本身，忽略以 Info: 开头的行
+        if not stripped or stripped.startswith(('<', 'Info:')) or stripped.endswith(('#', '>')):
+            continue
+        # 移除命令行
+        if 'display' in line and 'configuration' in line:
+            continue
+        lines.append(stripped)
+    return lines
+
+def compare_config_lines(running_lines, startup_lines):
+    """比较已清理的配置行，返回(新增的行, 删除的行)"""
     running_set = set(running_lines)
     startup_set = set(startup_lines)
     
@@ -163,205 +284,384 @@ def compare_configs(running_config, startup_config):
     
     return added_lines, removed_lines
 
-def save_config_to_file(hostname, config_type, config_content, device_name=None):
-    """将配置保存到文件"""
-    # 创建备份目录
-    backup_dir = "backups"
-    if not os.path.exists(backup_dir):
-        os.makedirs(backup_dir)
-    
-    # 使用设备名称作为第一级目录
+def compare_configs(running_config, startup_config):
+    # 比较运行配置和已保存配置
+    return compare_config_lines(clean_config(running_config), clean_config(startup_config))
+
+def save_config_to_file(hostname, config_type, config_content, device_name=None, batch=None):
+    """
+    将配置保存到文件
+    提供batch时只暂存到该批次，由调用方统一提交；否则立即原子写入
+    """
+    # 使用 设备名称/配置类型/年月日时分 作为目录
     device_name = device_name or hostname
-    device_dir = os.path.join(backup_dir, device_name)
-    if not os.path.exists(device_dir):
-        os.makedirs(device_dir)
-    
-    # 使用配置类型作为第二级目录
-    config_type_dir = os.path.join(device_dir, config_type)
-    if not os.path.exists(config_type_dir):
-        os.makedirs(config_type_dir)
-    
-    # 使用年月日时分作为第三级目录
     timestamp_dir = datetime.datetime.now().strftime("%Y%m%d%H%M")
-    final_dir = os.path.join(config_type_dir, timestamp_dir)
-    
-    # 检查是否有之前的备份
-    previous_backup = get_latest_backup(config_type_dir)
+    final_dir = os.path.join("backups", device_name, config_type, timestamp_dir)
     
-    # 如果有之前的备份，创建临时文件比较内容
-    if previous_backup:
-        temp_file = os.path.join(device_dir, f"temp_{config_type}.txt")
-        with open(temp_file, 'w', encoding='utf-8') as f:
-            f.write(config_content)
-        
-        # 获取上一次备份的文件路径
-        prev_backup_file = os.path.join(previous_backup, f"{hostname}_{config_type}.txt")
-        
-        # 比较文件内容
-        if os.path.exists(prev_backup_file) and files_are_identical(temp_file, prev_backup_file):
-            # 如果内容相同，删除临时文件并返回上一次的备份文件路径
-            os.remove(temp_file)
-            device_info = f"{device_name}({hostname})" if device_name != hostname else hostname
-            print(f"设备 {device_info} - {config_type}配置与上次备份相同，跳过备份")
-            return prev_backup_file
-        
-        # 删除临时文件
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
+    # 检查是否有之前的备份，内容相同则返回上一次的备份文件路径
+    prev_backup_file, prev_config = read_latest_backup(hostname, config_type, device_name)
+    if prev_backup_file and prev_config == config_content:
+        device_info = f"{device_name}({hostname})" if device_name != hostname else hostname
+        print(f"设备 {device_info} - {config_type}配置与上次备份相同，跳过备份")
+        return prev_backup_file
     
     # 如果没有之前的备份或内容不同，创建新的备份
-    if not os.path.exists(final_dir):
-        os.makedirs(final_dir)
-    
-    # 生成文件名
-    filename = f"{hostname}_{config_type}.txt"
-    filepath = os.path.join(final_dir, filename)
-    
-    # 保存配置到文件
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(config_content)
+    filepath = os.path.join(final_dir, f"{hostname}_{config_type}.txt")
+    if batch is not None:
+        batch.write_text(filepath, config_content)
+    else:
+        with WriteBatch() as own_batch:
+            own_batch.write_text(filepath, config_content)
     
     device_info = f"{device_name}({hostname})" if device_name != hostname else hostname
     print(f"设备 {device_info} - {config_type}配置已保存到 {filepath}")
     return filepath
 
-def get_latest_backup(config_dir):
-    """获取最新的备份目录"""
-    if not os.path.exists(config_dir):
-        return None
+def read_latest_backup(hostname, config_type, device_name=None):
+    """
+    读取最近一次备份的配置，返回(文件路径, 配置内容)，没有备份时返回(None, None)
+    只有已发布的配置文件才会作为基准，缺少配置文件的时间戳目录（如写入中途崩溃留下的）会被跳过
+    """
+    device_name = device_name or hostname
+    config_type_dir = os.path.join("backups", device_name, config_type)
+    if not os.path.isdir(config_type_dir):
+        return None, None
     
-    # 获取所有备份目录（格式为年月日时分）
-    backup_dirs = [d for d in os.listdir(config_dir) if os.path.isdir(os.path.join(config_dir, d))]
+    for timestamp_dir in sorted(os.listdir(config_type_dir), reverse=True):
+        latest_file = os.path.join(config_type_dir, timestamp_dir, f"{hostname}_{config_type}.txt")
+        if os.path.isfile(latest_file):
+            # 保留原始换行符，确保与设备输出逐字节比较
+            with open(latest_file, 'r', encoding='utf-8', newline='') as f:
+                return latest_file, f.read()
+    return None, None
+
+def decompress_config(data):
+    """解压设备上的配置文件（zip或gzip格式），返回解码后的配置文本"""
+    if data[:4] == b'PK\x03\x04':
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            members = [name for name in archive.namelist() if not name.endswith('/')]
+            data = archive.read(members[0])
+    elif data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    return data.decode('utf-8', errors='ignore')
+
+def load_remote_state(hostname, device_name=None):
+    """读取上次下载的启动配置文件状态"""
+    state_file = os.path.join("backups", device_name or hostname, "startup", REMOTE_STATE_FILE)
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_remote_state(hostname, state, device_name=None):
+    """保存本次下载的启动配置文件状态"""
+    startup_dir = os.path.join("backups", device_name or hostname, "startup")
+    os.makedirs(startup_dir, exist_ok=True)
+    with open(os.path.join(startup_dir, REMOTE_STATE_FILE), 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+
+def load_compare_cache(device_name):
+    """读取设备的配置比较缓存，清理规则版本不一致时丢弃"""
+    cache_file = os.path.join("backups", device_name, "diff", COMPARE_CACHE_FILE)
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('normalizer') == COMPARE_NORMALIZER_VERSION:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {'normalizer': COMPARE_NORMALIZER_VERSION, 'entries': {}, 'last_digest': None}
+
+def save_compare_cache(device_name, cache, batch):
+    """将比较缓存暂存到批次中，与本次备份一起发布"""
+    batch.write_text(os.path.join("backups", device_name, "diff", COMPARE_CACHE_FILE),
+                     json.dumps(cache, ensure_ascii=False))
+
+def cached_compare(cache, config, base_config, lines=None):
+    """
+    比较两份配置，相同内容的比较直接返回缓存的结果
+    :param lines: 可选，返回config清理后配置行的函数（如等待后台任务的结果），缓存未命中时才调用
+    :return: (新增的行, 删除的行, 是否命中缓存)，行已排序
+    """
+    key = hashlib.sha256(config.encode('utf-8')).hexdigest() + ":" + \
+        hashlib.sha256(base_config.encode('utf-8')).hexdigest()
+    entry = cache['entries'].pop(key, None)
+    hit = entry is not None
+    if not hit:
+        added, removed = compare_config_lines(lines() if lines else clean_config(config), clean_config(base_config))
+        entry = {'added': sorted(added), 'removed': sorted(removed)}
     
-    # 按照时间戳排序
-    backup_dirs.sort(reverse=True)
+    # 最近使用的条目放在最后，超出容量时淘汰最早的条目
+    cache['entries'][key] = entry
+    for stale_key in list(cache['entries'])[:-COMPARE_CACHE_SIZE]:
+        del cache['entries'][stale_key]
+    return entry['added'], entry['removed'], hit
+
+def fetch_startup_file(device, ssh_pool=None):
+    """
+    通过SFTP或SCP直接下载设备上的启动配置文件，必要时解压
+    SFTP模式下先比较文件大小和修改时间，与上次下载一致且上次备份完好时跳过下载，直接返回上次备份的内容
+    """
+    hostname = device['hostname']
+    device_name = device.get('device_name', '')
+    device_info = f"{device_name}({hostname})" if device_name else hostname
+    mode = device['startup_fetch']
+    remote_path = device.get('startup_file') or STARTUP_FILES.get(device.get('device_type'), 'startup.cfg')
     
-    if backup_dirs:
-        return os.path.join(config_dir, backup_dirs[0])
+    if ssh_pool is not None:
+        ssh_client = ssh_pool.get(hostname, device['username'], device['password'], device.get('port', 22),
+                                  device.get('via'))
+    else:
+        ssh_client = connect_device(hostname, device['username'], device['password'], device.get('port', 22),
+                                    device.get('via'))
     
-    return None
+    try:
+        buffer = io.BytesIO()
+        remote_state = None
+        
+        if mode == 'sftp':
+            sftp = ssh_client.open_sftp()
+            try:
+                attrs = sftp.stat(remote_path)
+                remote_state = {'path': remote_path, 'size': attrs.st_size, 'mtime': attrs.st_mtime}
+                
+                previous_state = load_remote_state(hostname, device_name)
+                if all(previous_state.get(k) == v for k, v in remote_state.items()):
+                    _, previous_config = read_latest_backup(hostname, "startup", device_name)
+                    if (previous_config is not None and
+                            hashlib.sha256(previous_config.encode('utf-8')).hexdigest() == previous_state.get('sha256')):
+                        print(f"设备 {device_info} - 启动配置文件 {remote_path} 大小和修改时间未变化，跳过下载")
+                        return previous_config
+                
+                print(f"设备 {device_info} - 通过SFTP下载启动配置文件 {remote_path} ({attrs.st_size} 字节)")
+                sftp.getfo(remote_path, buffer)
+            finally:
+                sftp.close()
+        else:
+            from scp import SCPClient
+            
+            print(f"设备 {device_info} - 通过SCP下载启动配置文件 {remote_path}")
+            with SCPClient(ssh_client.get_transport()) as scp_client:
+                scp_client.getfo(remote_path, buffer)
+        
+        config = decompress_config(buffer.getvalue())
+        if remote_state is not None:
+            remote_state['sha256'] = hashlib.sha256(config.encode('utf-8')).hexdigest()
+            save_remote_state(hostname, remote_state, device_name)
+        return config
+    finally:
+        if ssh_pool is not None:
+            ssh_pool.release(hostname, device['username'], device.get('port', 22))
+        else:
+            ssh_client.close()
 
-def files_are_identical(file1, file2):
-    """比较两个文件内容是否相同"""
-    # 使用filecmp模块比较文件
-    return filecmp.cmp(file1, file2, shallow=False)
+def fetch_config(device, config_type, ssh_pool=None):
+    """通过SSH获取设备的一类配置（running或startup）"""
+    device_name = device.get('device_name', '')
+    device_info = f"{device_name}({device['hostname']})" if device_name else device['hostname']
+    label = CONFIG_TYPE_LABELS[config_type]
+    
+    print(f"设备 {device_info} - 获取{label}...")
+    with profiling.phase(device_info, f"fetch_{config_type}"):
+        if config_type == 'startup' and device.get('startup_fetch') in ('sftp', 'scp'):
+            try:
+                config = fetch_startup_file(device, ssh_pool)
+                print(f"设备 {device_info} - 获取到{label}，长度: {len(config)} 字节")
+                return config
+            except Exception as e:
+                print(f"设备 {device_info} - 下载启动配置文件失败: {str(e)}，改用命令获取")
+        
+        # 无论是华为还是华三设备，都使用相同的命令
+        config = get_config(device['hostname'], device['username'], device['password'], device.get('port', 22),
+                            CONFIG_COMMANDS[config_type], device_type=device.get('device_type', 'unknown'),
+                            device_name=device_name, ssh_pool=ssh_pool, via=device.get('via'))
+        print(f"设备 {device_info} - 获取到{label}，长度: {len(config)} 字节")
+        return config
 
-def process_device(device):
-    """处理单个设备的配置备份和比较"""
+def fetch_device_configs(device, ssh_pool=None, capture_state=False):
+    """
+    I/O阶段：通过SSH获取设备的运行配置和启动配置
+    capture_state为True时在获取运行配置的同一会话中采集运行状态，结果放在state中
+    """
     hostname = device['hostname']
-    username = device['username']
-    password = device['password']
-    port = device.get('port', 22)
     device_type = device.get('device_type', 'unknown')
     device_name = device.get('device_name', '')
     
     device_info = f"{device_name}({hostname})" if device_name else hostname
+    fetched = {'running_config': None, 'startup_config': None, 'error': None, 'startup_error': None, 'state': None}
     
     try:
         print(f"\n开始处理设备: {device_info} (类型: {device_type})")
-        
-        # 获取运行配置
-        print(f"设备 {device_info} - 获取运行配置...")
-        running_config = get_config(hostname, username, password, port, 'display current-configuration', 
-                                   device_type=device_type, device_name=device_name)
-        print(f"设备 {device_info} - 获取到运行配置，长度: {len(running_config)} 字节")
-        
+        if capture_state:
+            fetched['running_config'], fetched['state'] = fetch_running_with_state(device, ssh_pool)
+        else:
+            fetched['running_config'] = fetch_config(device, 'running', ssh_pool)
+    except Exception as e:
+        print(f"设备 {device_info} - 处理失败: {str(e)}")
+        fetched['error'] = str(e)
+        return fetched
+    
+    try:
+        fetched['startup_config'] = fetch_config(device, 'startup', ssh_pool)
+    except Exception as e:
+        print(f"设备 {device_info} - 获取启动配置失败: {str(e)}")
+        fetched['startup_error'] = str(e)
+    
+    return fetched
+
+def fetch_running_with_state(device, ssh_pool=None):
+    """
+    I/O阶段：在获取运行配置的同一个交互会话中依次执行设备类型对应的状态命令，不为状态采集另建连接
+    :return: (运行配置, {'platform': ntc_templates平台名, 'outputs': {命令: 输出}, 'captured_at': 采集时间})，
+             设备类型没有定义状态命令时只获取运行配置，状态为None
+    """
+    device_name = device.get('device_name', '')
+    device_info = f"{device_name}({device['hostname']})" if device_name else device['hostname']
+    platform, commands = state_capture.STATE_COMMANDS.get(device.get('device_type'), (None, None))
+    if platform is None:
+        print(f"设备 {device_info} - 设备类型 {device.get('device_type')} 没有定义状态命令，跳过状态采集")
+        return fetch_config(device, 'running', ssh_pool), None
+    
+    print(f"设备 {device_info} - 获取运行配置并采集运行状态...")
+    running_command = CONFIG_COMMANDS['running']
+    with profiling.phase(device_info, "fetch_running"):
+        captured_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        outputs = get_command_outputs(device['hostname'], device['username'], device['password'],
+                                      device.get('port', 22), [running_command] + commands,
+                                      device_type=device.get('device_type'), device_name=device_name,
+                                      ssh_pool=ssh_pool, via=device.get('via'))
+    running_config = outputs.pop(running_command)
+    print(f"设备 {device_info} - 获取到{CONFIG_TYPE_LABELS['running']}，长度: {len(running_config)} 字节")
+    return running_config, {'platform': platform, 'outputs': outputs, 'captured_at': captured_at}
+
+def state_snapshot(device, state, tables, errors):
+    """构造写入StateStore的快照记录"""
+    return {'device_name': device.get('device_name') or device['hostname'], 'hostname': device['hostname'],
+            'platform': state['platform'], 'captured_at': state['captured_at'], 'tables': tables, 'errors': errors}
+
+def save_state_snapshots(snapshots):
+    """写入一批状态快照，失败只打印错误，不影响备份结果"""
+    try:
+        with profiling.phase(None, "save_state"):
+            state_capture.StateStore().save_snapshots(snapshots)
+        print(f"已保存 {len(snapshots)} 个设备的运行状态快照到 {state_capture.STATE_DB}")
+    except Exception as e:
+        print(f"保存运行状态快照失败: {str(e)}")
+
+def failed_result(device, error):
+    """构造处理失败的设备结果"""
+    return {
+        'hostname': device['hostname'],
+        'device_name': device.get('device_name', ''),
+        'status': 'failed',
+        'error': error
+    }
+
+def commit_device_batch(device, batch, result):
+    """提交设备的暂存写入，失败的设备丢弃暂存文件；提交出错时返回失败结果"""
+    if result['status'] == 'failed':
+        batch.discard()
+        return result
+    
+    try:
+        batch.commit()
+    except Exception as e:
+        print(f"设备 {result['hostname']} - 写入备份失败: {str(e)}")
+        batch.discard()
+        return failed_result(device, f"写入备份失败: {str(e)}")
+    config_blame.update_results_blame([result])
+    return result
+
+def analyze_device_configs(device, running_config, startup_config=None, startup_error=None, prefetched=None,
+                           batch=None):
+    """
+    CPU阶段：清理、比较并保存配置，不涉及网络I/O，可在子进程中执行
+    :param prefetched: 可选，process_device在获取启动配置期间提前启动的后台任务（Future），
+                       键为running_config_file、running_lines、previous_startup，缺少的项在此处直接计算
+    :param batch: 可选，写入只暂存到该批次，由调用方统一提交；未提供时处理完成后立即提交
+    """
+    if batch is None:
+        batch = WriteBatch()
+        result = analyze_device_configs(device, running_config, startup_config, startup_error, prefetched, batch)
+        return commit_device_batch(device, batch, result)
+    
+    hostname = device['hostname']
+    device_name = device.get('device_name', '')
+    prefetched = prefetched or {}
+    
+    device_info = f"{device_name}({hostname})" if device_name else hostname
+    
+    def resolve(key, compute, *args):
+        # 已有后台任务时等待其结果，否则直接计算
+        if key in prefetched:
+            return prefetched[key].result()
+        return compute(*args)
+    
+    try:
         # 保存运行配置到文件
-        running_config_file = save_config_to_file(hostname, "running", running_config, device_name)
+        running_config_file = resolve('running_config_file', save_config_to_file,
+                                      hostname, "running", running_config, device_name, batch)
         
-        # 获取启动配置
-        print(f"设备 {device_info} - 获取启动配置...")
         try:
-            # 无论是华为还是华三设备，都使用相同的命令
-            startup_config = get_config(hostname, username, password, port, 'display saved-configuration', 
-                                       device_type=device_type, device_name=device_name)
-            print(f"设备 {device_info} - 获取到启动配置，长度: {len(startup_config)} 字节")
+            if startup_config is None:
+                raise RuntimeError(startup_error or "未获取到启动配置")
             
             # 检查启动配置是否与最近一次相同
             startup_changed = True  # 默认假设有变化
-            prev_startup_added = set()  # 存储当前startup相比上次新增的行
-            prev_startup_removed = set()  # 存储当前startup相比上次删除的行
-            startup_diff_lines = []  # 存储启动配置差异的行，初始化为空列表
+            prev_startup_added = []  # 存储当前startup相比上次新增的行
+            prev_startup_removed = []  # 存储当前startup相比上次删除的行
             
-            # 获取最近一次的启动配置目录
+            # 获取最近一次的启动配置
             device_name = device_name or hostname
-            startup_dir = os.path.join("backups", device_name, "startup")
-            if os.path.exists(startup_dir):
-                latest_startup_dir = get_latest_backup(startup_dir)
-                
-                if latest_startup_dir:
-                    # 获取最近一次启动配置文件路径
-                    latest_startup_file = os.path.join(latest_startup_dir, f"{hostname}_startup.txt")
-                    
-                    # 比较文件内容
-                    if os.path.exists(latest_startup_file):
-                        # 读取上一次的启动配置
-                        with open(latest_startup_file, 'r', encoding='utf-8') as f:
-                            prev_startup_config = f.read()
-                        
-                        # 创建临时文件保存当前启动配置
-                        temp_file = os.path.join(startup_dir, f"temp_{hostname}_startup.txt")
-                        with open(temp_file, 'w', encoding='utf-8') as f:
-                            f.write(startup_config)
-                        
-                        if files_are_identical(temp_file, latest_startup_file):
-                            startup_changed = False
-                            print(f"设备 {device_info} - 启动配置与上次相同，使用上次的配置文件")
-                            startup_config_file = latest_startup_file
-                        else:
-                            # 如果启动配置有变化，计算差异
-                            print(f"设备 {device_info} - 启动配置与上次不同，计算差异")
-                            
-                            # 比较当前startup和上次备份的startup
-                            prev_startup_added, prev_startup_removed = compare_configs(startup_config, prev_startup_config)
-                        
-                            if prev_startup_added:
-                                startup_diff_lines.append("当前启动配置相比上次备份新增的行:")
-                                for line in prev_startup_added:
-                                    startup_diff_lines.append(f"+ {line}")
-                            else:
-                                startup_diff_lines.append("当前启动配置相比上次备份没有新增的行。")
-                            
-                            startup_diff_lines.append("")  # 空行分隔
-                            
-                            if prev_startup_removed:
-                                startup_diff_lines.append("当前启动配置相比上次备份删除的行:")
-                                for line in prev_startup_removed:
-                                    startup_diff_lines.append(f"- {line}")
-                            else:
-                                startup_diff_lines.append("当前启动配置相比上次备份没有删除的行。")
-                    
-                    # 删除临时文件
-                    if os.path.exists(temp_file):
-                        os.remove(temp_file)
+            compare_cache = load_compare_cache(device_name)
+            cache_dirty = False
+            latest_startup_file, prev_startup_config = resolve('previous_startup', read_latest_backup,
+                                                               hostname, "startup", device_name)
+            if latest_startup_file:
+                if startup_config == prev_startup_config:
+                    startup_changed = False
+                    print(f"设备 {device_info} - 启动配置与上次相同，使用上次的配置文件")
+                    startup_config_file = latest_startup_file
+                else:
+                    # 如果启动配置有变化，比较当前startup和上次备份的startup
+                    print(f"设备 {device_info} - 启动配置与上次不同，计算差异")
+                    prev_startup_added, prev_startup_removed, hit = cached_compare(
+                        compare_cache, startup_config, prev_startup_config)
+                    cache_dirty = cache_dirty or not hit
             
             # 如果启动配置有变化，保存到文件
             if startup_changed:
-                startup_config_file = save_config_to_file(hostname, "startup", startup_config, device_name)
+                startup_config_file = save_config_to_file(hostname, "startup", startup_config, device_name, batch)
             
-            # 比较配置
-            added_lines, removed_lines = compare_configs(running_config, startup_config)
+            # 比较配置，运行配置和启动配置都与之前比较过的相同时直接使用缓存的结果
+            added_lines, removed_lines, compare_cached = cached_compare(
+                compare_cache, running_config, startup_config,
+                lambda: resolve('running_lines', clean_config, running_config))
+            if compare_cached:
+                print(f"设备 {device_info} - 运行配置与启动配置的比较结果已缓存，跳过比较")
             
-            # 检查是否有差异
+            # 检查是否有差异，比较结果与上次不同时记录新的结果摘要
             has_diff = bool(added_lines or removed_lines)
+            diff_digest = hashlib.sha256(json.dumps([added_lines, removed_lines]).encode('utf-8')).hexdigest()
+            diff_changed = diff_digest != compare_cache['last_digest']
+            if diff_changed or not compare_cached:
+                compare_cache['last_digest'] = diff_digest
+                cache_dirty = True
             diff_file = None
             
-            # 如果有差异且启动配置有变化，保存差异到文件
-            if has_diff and startup_changed:
-                # 使用设备名称作为第一级目录
-                diff_dir = os.path.join("backups", device_name, "diff")
-                if not os.path.exists(diff_dir):
-                    os.makedirs(diff_dir)
-                
-                # 使用年月日时分作为第二级目录
+            # 启动配置有变化、且比较结果或启动配置内容确有变化时才生成diff报告
+            write_report = startup_changed and bool(diff_changed or prev_startup_added or prev_startup_removed)
+            
+            # 如果有差异且需要生成报告，保存差异到文件
+            if has_diff and write_report:
+                # 使用 设备名称/diff/年月日时分 作为目录，目录在暂存时一次创建
                 timestamp_dir = datetime.datetime.now().strftime("%Y%m%d%H%M")
-                final_diff_dir = os.path.join(diff_dir, timestamp_dir)
-                if not os.path.exists(final_diff_dir):
-                    os.makedirs(final_diff_dir)
+                final_diff_dir = os.path.join("backups", device_name, "diff", timestamp_dir)
                 
                 diff_file = os.path.join(final_diff_dir, f"{hostname}_diff.txt")
                 
-                with open(diff_file, 'w', encoding='utf-8') as f:
+                with io.StringIO() as f:
                     f.write(f"设备: {device_info}\n")
                     f.write(f"比较时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
                     
@@ -397,23 +697,18 @@ def process_device(device):
                                 f.write(f"- {line}\n")
                         else:
                             f.write("启动配置中没有删除的行。\n")
+                    
+                    batch.write_text(diff_file, f.getvalue())
                 
                 print(f"设备 {device_info} - 配置差异已保存到 {diff_file}")
-            elif startup_changed:  # 只有启动配置有变化
-                # 使用设备名称作为第一级目录
-                diff_dir = os.path.join("backups", device_name, "diff")
-                if not os.path.exists(diff_dir):
-                    os.makedirs(diff_dir)
-                
-                # 使用年月日时分作为第二级目录
+            elif write_report:  # 只有启动配置有变化
+                # 使用 设备名称/diff/年月日时分 作为目录，目录在暂存时一次创建
                 timestamp_dir = datetime.datetime.now().strftime("%Y%m%d%H%M")
-                final_diff_dir = os.path.join(diff_dir, timestamp_dir)
-                if not os.path.exists(final_diff_dir):
-                    os.makedirs(final_diff_dir)
+                final_diff_dir = os.path.join("backups", device_name, "diff", timestamp_dir)
                 
                 diff_file = os.path.join(final_diff_dir, f"{hostname}_diff.txt")
                 
-                with open(diff_file, 'w', encoding='utf-8') as f:
+                with io.StringIO() as f:
                     f.write(f"设备: {device_info}\n")
                     f.write(f"比较时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
                     
@@ -436,8 +731,12 @@ def process_device(device):
                             f.write(f"- {line}\n")
                     else:
                         f.write("启动配置中没有删除的行。\n")
+                    
+                    batch.write_text(diff_file, f.getvalue())
                 
                 print(f"设备 {device_info} - 启动配置有变化，差异已保存到 {diff_file}")
+            elif startup_changed:
+                print(f"设备 {device_info} - 启动配置有变化，但比较结果与上次相同，跳过生成diff报告")
             elif has_diff:
                 print(f"设备 {device_info} - 有配置差异，但启动配置未变化，跳过生成diff报告")
             else:
@@ -459,6 +758,9 @@ def process_device(device):
             else:
                 print(f"设备 {device_info} - 没有删除的行。")
             
+            if cache_dirty:
+                save_compare_cache(device_name, compare_cache, batch)
+            
             return {
                 'hostname': hostname,
                 'device_name': device_name,
@@ -467,11 +769,14 @@ def process_device(device):
                 'startup_config_file': startup_config_file,
                 'diff_file': diff_file,
                 'has_diff': has_diff,
-                'startup_changed': startup_changed  # 添加标记表示启动配置是否变化
+                'startup_changed': startup_changed,  # 添加标记表示启动配置是否变化
+                'diff_changed': diff_changed,  # 比较结果是否与上次不同
+                'compare_cached': compare_cached
             }
             
         except Exception as e:
-            print(f"设备 {device_info} - 获取启动配置失败: {str(e)}")
+            if startup_config is not None:
+                print(f"设备 {device_info} - 处理启动配置失败: {str(e)}")
             return {
                 'hostname': hostname,
                 'device_name': device_name,
@@ -482,14 +787,287 @@ def process_device(device):
             
     except Exception as e:
         print(f"设备 {device_info} - 处理失败: {str(e)}")
-        return {
-            'hostname': hostname,
-            'device_name': device_name,
-            'status': 'failed',
-            'error': str(e)
+        return failed_result(device, str(e))
+
+def process_device(device, ssh_pool=None, capture_state=False):
+    """
+    处理单个设备的配置备份和比较
+    获取启动配置期间，在后台线程中预读上一次的启动配置、保存并清理运行配置，
+    使本地磁盘I/O与设备传输重叠，单设备耗时接近两次传输时间之和
+    capture_state为True时在获取运行配置的同一会话中采集运行状态，备份提交后解析并写入 backups/state.db
+    """
+    hostname = device['hostname']
+    device_type = device.get('device_type', 'unknown')
+    device_name = device.get('device_name', '')
+    
+    device_info = f"{device_name}({hostname})" if device_name else hostname
+    batch = WriteBatch()
+    
+    with ThreadPoolExecutor(max_workers=2) as io_pool:
+        prefetched = {
+            'previous_startup': io_pool.submit(profiling.wrap(device_info, "read_previous_startup", read_latest_backup),
+                                               hostname, "startup", device_name),
         }
+        
+        try:
+            print(f"\n开始处理设备: {device_info} (类型: {device_type})")
+            state = None
+            if capture_state:
+                running_config, state = fetch_running_with_state(device, ssh_pool)
+            else:
+                running_config = fetch_config(device, 'running', ssh_pool)
+        except Exception as e:
+            print(f"设备 {device_info} - 处理失败: {str(e)}")
+            return failed_result(device, str(e))
+        
+        prefetched['running_config_file'] = io_pool.submit(profiling.wrap(device_info, "save_running", save_config_to_file),
+                                                           hostname, "running", running_config, device_name, batch)
+        prefetched['running_lines'] = io_pool.submit(profiling.wrap(device_info, "clean_running", clean_config),
+                                                     running_config)
+        
+        startup_config, startup_error = None, None
+        try:
+            startup_config = fetch_config(device, 'startup', ssh_pool)
+        except Exception as e:
+            print(f"设备 {device_info} - 获取启动配置失败: {str(e)}")
+            startup_error = str(e)
+        
+        with profiling.phase(device_info, "analyze"):
+            result = analyze_device_configs(device, running_config, startup_config, startup_error, prefetched, batch)
+    
+    with profiling.phase(device_info, "commit"):
+        result = commit_device_batch(device, batch, result)
+    
+    if state is not None:
+        try:
+            with profiling.phase(device_info, "parse_state"):
+                tables, errors = state_capture.parse_state_outputs(state['platform'], state['outputs'])
+            save_state_snapshots([state_snapshot(device, state, tables, errors)])
+        except Exception as e:
+            print(f"设备 {device_info} - 解析运行状态失败: {str(e)}")
+    return result
+
+def spool_config(config_content):
+    """将配置写入暂存文件并返回路径，供CPU阶段的子进程直接读取"""
+    if config_content is None:
+        return None
+    
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    fd, spool_file = tempfile.mkstemp(prefix="cfg_", suffix=".txt", dir=SPOOL_DIR)
+    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+        f.write(config_content)
+    return spool_file
+
+def remove_spool_files(*spool_files):
+    """删除未被CPU阶段读取的暂存文件，配置中可能包含密码等敏感信息"""
+    for spool_file in spool_files:
+        if spool_file is None:
+            continue
+        try:
+            os.remove(spool_file)
+        except FileNotFoundError:
+            pass
 
-def main():
+def clean_stale_spool_files(max_age=SPOOL_STALE_SECONDS):
+    """启动时删除上次运行崩溃遗留的暂存文件，返回删除的数量"""
+    if not os.path.isdir(SPOOL_DIR):
+        return 0
+    
+    removed = 0
+    deadline = time.time() - max_age
+    for filename in os.listdir(SPOOL_DIR):
+        spool_file = os.path.join(SPOOL_DIR, filename)
+        try:
+            if filename.startswith("cfg_") and os.path.getmtime(spool_file) < deadline:
+                os.remove(spool_file)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+def load_spooled_config(spool_file):
+    """读取暂存文件中的配置，读取后删除暂存文件"""
+    if spool_file is None:
+        return None
+    
+    try:
+        with open(spool_file, 'r', encoding='utf-8', newline='') as f:
+            return f.read()
+    finally:
+        os.remove(spool_file)
+
+def analyze_spooled_configs(device, running_spool, startup_spool, startup_error):
+    """
+    进程池入口：从暂存文件加载配置后执行CPU阶段
+    写入只暂存不提交，暂存文件列表通过结果的staged_writes返回，由主进程在本次运行结束时统一提交
+    """
+    device_name = device.get('device_name', '')
+    device_info = f"{device_name}({device['hostname']})" if device_name else device['hostname']
+    
+    with profiling.phase(device_info, "analyze"):
+        running_config = load_spooled_config(running_spool)
+        startup_config = load_spooled_config(startup_spool)
+        batch = WriteBatch()
+        result = analyze_device_configs(device, running_config, startup_config, startup_error, batch=batch)
+    
+    if result['status'] == 'failed':
+        batch.discard()
+    else:
+        result['staged_writes'] = batch.pending()
+    if profiling.is_enabled():
+        # 子进程中记录的性能数据随结果返回主进程合并
+        result['profile_data'] = profiling.drain()
+    return result
+
+def cpu_pool_context():
+    """
+    CPU阶段进程池的启动方式：抓取线程和paramiko已在运行，fork出的子进程可能继承被占用的锁，
+    优先使用forkserver，不支持forkserver的平台（Windows）使用spawn
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+def create_cpu_pool(cpu_workers=CPU_WORKERS):
+    """创建CPU阶段进程池，常驻进程可创建一次后在每次运行中复用，避免每次重新启动子进程"""
+    return ProcessPoolExecutor(max_workers=cpu_workers, mp_context=cpu_pool_context(),
+                               initializer=profiling.start_worker if profiling.is_enabled() else None)
+
+def run_backup_pipeline(devices, fetch_workers=FETCH_WORKERS, cpu_workers=CPU_WORKERS, queue_size=PIPELINE_QUEUE_SIZE,
+                        ssh_pool=None, capture_state=False, cpu_pool=None):
+    """
+    两阶段备份流水线
+    I/O阶段在线程池中并发抓取配置，CPU阶段（清理/比较/写入）在进程池中执行，
+    两阶段之间使用有界队列：CPU阶段积压时抓取线程阻塞，形成背压
+    :param capture_state: 为True时在获取运行配置的同一会话中采集运行状态，TextFSM解析同样在进程池中执行，
+                          快照在本次运行结束时写入 backups/state.db
+    :param cpu_pool: 调用方持有的CPU阶段进程池（见create_cpu_pool），运行结束后不关闭；为None时按cpu_workers临时创建
+    :return: 与devices顺序一致的结果列表
+    """
+    fetched_queue = queue.Queue(maxsize=queue_size)
+    results = [None] * len(devices)
+    
+    def fetch_stage(index, device):
+        fetched = {}
+        try:
+            fetched = fetch_device_configs(device, ssh_pool, capture_state)
+            if fetched['error'] is None:
+                fetched['running_spool'] = spool_config(fetched.pop('running_config'))
+                fetched['startup_spool'] = spool_config(fetched.pop('startup_config'))
+        except Exception as e:
+            remove_spool_files(fetched.get('running_spool'), fetched.get('startup_spool'))
+            fetched = {'error': str(e)}
+        # 队列已满时阻塞，直到CPU阶段消化积压
+        fetched_queue.put((index, device, fetched))
+    
+    # 限制已提交但未完成的CPU任务数量，使背压能传导到队列
+    cpu_slots = threading.BoundedSemaphore(max(1, cpu_workers) * 2)
+    futures = {}
+    state_futures = {}
+    spool_files = {}  # 设备序号 -> 暂存文件，任务未成功执行时由主进程删除
+    
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetch_pool, \
+            (contextlib.nullcontext(cpu_pool) if cpu_pool is not None else create_cpu_pool(cpu_workers)) as cpu_pool:
+        for index, device in enumerate(devices):
+            fetch_pool.submit(fetch_stage, index, device)
+        
+        pool_error = None
+        for _ in range(len(devices)):
+            # 进程池损坏后也要继续取出队列中的结果，否则抓取线程阻塞在put上，线程池无法退出
+            index, device, fetched = fetched_queue.get()
+            if fetched['error'] is not None:
+                results[index] = failed_result(device, fetched['error'])
+                continue
+            
+            future = None
+            if pool_error is None:
+                cpu_slots.acquire()
+                try:
+                    future = cpu_pool.submit(analyze_spooled_configs, device, fetched['running_spool'],
+                                             fetched['startup_spool'], fetched['startup_error'])
+                except Exception as e:
+                    # 子进程异常退出（如被OOM终止）后进程池不再接受任务，剩余设备记为失败
+                    cpu_slots.release()
+                    pool_error = e
+                    print(f"CPU阶段进程池不可用: {str(e)}")
+            if future is None:
+                remove_spool_files(fetched['running_spool'], fetched['startup_spool'])
+                results[index] = failed_result(device, f"CPU阶段进程池不可用: {str(pool_error)}")
+                continue
+            future.add_done_callback(lambda _: cpu_slots.release())
+            futures[future] = index
+            spool_files[index] = (fetched['running_spool'], fetched['startup_spool'])
+            
+            if fetched.get('state'):
+                try:
+                    state_futures[index] = (fetched['state'], cpu_pool.submit(
+                        state_capture.parse_state_outputs, fetched['state']['platform'], fetched['state']['outputs']))
+                except Exception as e:
+                    print(f"设备 {device.get('device_name') or device['hostname']} - 解析运行状态失败: {str(e)}")
+        
+        for future, index in futures.items():
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                # 子进程可能在读取暂存文件前退出
+                remove_spool_files(*spool_files[index])
+                results[index] = failed_result(devices[index], str(e))
+        
+        snapshots = []
+        for index, (state, future) in state_futures.items():
+            device = devices[index]
+            try:
+                tables, errors = future.result()
+            except Exception as e:
+                print(f"设备 {device.get('device_name') or device['hostname']} - 解析运行状态失败: {str(e)}")
+                continue
+            snapshots.append(state_snapshot(device, state, tables, errors))
+    
+    # 所有设备的写入在本次运行结束时统一fsync并原子发布
+    run_batch = WriteBatch()
+    for result in results:
+        run_batch.adopt(result.pop('staged_writes', []))
+        profiling.merge(result.pop('profile_data', None))
+    try:
+        with profiling.phase(None, "commit"):
+            run_batch.commit()
+    except Exception as e:
+        print(f"写入备份失败: {str(e)}")
+        run_batch.discard()
+        results = [result if result['status'] == 'failed' else failed_result(device, f"写入备份失败: {str(e)}")
+                   for device, result in zip(devices, results)]
+    
+    # 新版本发布后增量更新配置溯源缓存
+    with profiling.phase(None, "blame"):
+        config_blame.update_results_blame(results)
+    
+    # 更新配置相似度签名，依赖NumPy，只在此处导入
+    try:
+        with profiling.phase(None, "similarity"):
+            import config_similarity
+            
+            config_similarity.update_results_signatures(results)
+    except Exception as e:
+        print(f"更新配置相似度签名失败: {str(e)}")
+    
+    if snapshots:
+        save_state_snapshots(snapshots)
+    
+    return results
+
+def main(profile=False, capture_state=False):
+    """
+    执行一次备份，profile为True时记录性能分析数据并写入 backups/reports/，
+    capture_state为True时同时采集设备运行状态
+    """
+    if profile:
+        profiling.enable()
+    try:
+        run_backup(capture_state)
+    finally:
+        profiling.finish("backup")
+
+def run_backup(capture_state=False):
     # 检查是否存在设备CSV文件
     csv_file = 'devices.csv'
     if os.path.exists(csv_file):
@@ -509,22 +1087,31 @@ def main():
     
     print(f"找到 {len(devices)} 个设备")
     
+    stale = clean_stale_spool_files()
+    if stale:
+        print(f"已清理 {stale} 个遗留的配置暂存文件")
+    
     # 处理每个设备
-    results = []
+    results = run_backup_pipeline(devices, capture_state=capture_state)
+    write_summary_report(results)
+
+def write_summary_report(results):
+    """输出汇总信息，有差异且有启动配置变化，或任一设备的比较结果有变化时写入当天的汇总报告"""
     has_any_diff = False
     has_any_startup_change = False  # 添加标记表示是否有任何设备的启动配置变化
+    has_any_diff_change = False  # 任一设备的比较结果与上次不同
     
-    for device in devices:
-        result = process_device(device)
-        results.append(result)
+    for result in results:
         if result.get('status') == 'success':
             if result.get('has_diff', False):
                 has_any_diff = True
             if result.get('startup_changed', False):
                 has_any_startup_change = True
+            if result.get('diff_changed', False):
+                has_any_diff_change = True
     
-    # 只有当有差异且有启动配置变化时才生成汇总报告
-    if has_any_diff and has_any_startup_change:
+    # 有差异且有启动配置变化，或比较结果有变化时才生成汇总报告
+    if (has_any_diff and has_any_startup_change) or has_any_diff_change:
         # 生成汇总报告
         print("\n配置备份和比较汇总报告:")
         for result in results:
@@ -537,20 +1124,17 @@ def main():
             if status == 'success':
                 diff_status = "有差异" if result['has_diff'] else "无差异"
                 startup_status = "有变化" if result.get('startup_changed', False) else "无变化"
-                print(f"设备 {device_info}: 成功 (配置差异: {diff_status}, 启动配置: {startup_status})")
+                compare_status = "有变化" if result.get('diff_changed', True) else "与上次相同"
+                print(f"设备 {device_info}: 成功 (配置差异: {diff_status}, 启动配置: {startup_status}, "
+                      f"比较结果: {compare_status})")
             elif status == 'partial':
                 print(f"设备 {device_info}: 部分成功 (只获取了运行配置)")
             else:
                 print(f"设备 {device_info}: 失败 - {result.get('error', '未知错误')}")
         
-        # 使用年月日作为文件名
-        date_str = datetime.datetime.now().strftime("%Y%m%d")
-        report_dir = os.path.join("backups", "reports")
-        if not os.path.exists(report_dir):
-            os.makedirs(report_dir)
-        
         # 报告文件名使用年月日
-        report_file = os.path.join(report_dir, f"{date_str}.txt")
+        date_str = datetime.datetime.now().strftime("%Y%m%d")
+        report_file = os.path.join("backups", "reports", f"{date_str}.txt")
         
         # 获取当前时间作为本次报告的时间戳
         current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -575,6 +1159,8 @@ def main():
                     report_content += f"差异文件: {result['diff_file']}\n"
                 report_content += f"配置差异: {'有' if result['has_diff'] else '无'}\n"
                 report_content += f"启动配置变化: {'有' if result.get('startup_changed', False) else '无'}\n"
+                compare_status = "有变化" if result.get('diff_changed', True) else "与上次相同"
+                report_content += f"比较结果: {compare_status}{'（使用缓存）' if result.get('compare_cached') else ''}\n"
             elif status == 'partial':
                 report_content += f"运行配置文件: {result['running_config_file']}\n"
                 report_content += f"错误: {result.get('error', '未知错误')}\n"
@@ -585,14 +1171,13 @@ def main():
         
         report_content += "=" * 50 + "\n\n"
         
-        # 检查文件是否存在，如果存在则追加内容，否则创建新文件
-        if os.path.exists(report_file):
-            with open(report_file, 'a', encoding='utf-8') as f:
-                f.write(report_content)
+        # 检查文件是否存在，如果存在则追加内容，否则创建新文件（均为原子替换）
+        report_exists = os.path.exists(report_file)
+        with WriteBatch() as batch:
+            batch.write_text(report_file, report_content, append=True)
+        if report_exists:
             print(f"\n汇总报告已追加到 {report_file}")
         else:
-            with open(report_file, 'w', encoding='utf-8') as f:
-                f.write(report_content)
             print(f"\n汇总报告已保存到 {report_file}")
     else:
         if not has_any_diff:
@@ -631,4 +1216,10 @@ def load_devices_from_csv(csv_file):
     return devices
 
 if __name__ == '__main__':
-    main()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="网络设备配置备份")
+    parser.add_argument('--profile', action='store_true', help="记录各设备各阶段的性能分析数据")
+    parser.add_argument('--state', action='store_true', help="同时采集设备运行状态到 backups/state.db")
+    args = parser.parse_args()
+    main(profile=args.profile, capture_state=args.state)
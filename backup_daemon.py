@@ -0,0 +1,317 @@
+import argparse
+import datetime
+import heapq
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import backup_config
+from ssh_pool import SSHSessionPool
+
+DEFAULT_INTERVAL = 60  # 默认备份间隔（分钟）
+DEFAULT_JITTER = 0.1  # 每次调度在间隔的±10%内随机偏移，避免所有设备同时连接
+RELOAD_CHECK_SECONDS = 60  # 空闲时检查devices.csv是否变化的最长间隔
+
+def device_key(device):
+    """设备在调度器中的唯一标识，优先使用设备名称"""
+    return device.get('device_name') or device['hostname']
+
+def parse_group_intervals(values):
+    """解析 分组=分钟 形式的分组间隔参数"""
+    group_intervals = {}
+    for value in values or []:
+        group, _, minutes = value.partition('=')
+        group_intervals[group.strip()] = float(minutes)
+    return group_intervals
+
+def parse_diff_timestamp(diff_file):
+    """从diff文件所在的年月日时分目录名解析时间戳"""
+    ts_name = os.path.basename(os.path.dirname(diff_file))
+    try:
+        return datetime.datetime.strptime(ts_name, '%Y%m%d%H%M')
+    except ValueError:
+        return datetime.datetime.now()
+
+class BackupScheduler:
+    """
+    常驻备份调度器
+    设备间隔取自devices.csv的interval列（分钟），其次是group列对应的分组间隔，最后是默认间隔
+    """
+    def __init__(self, csv_file='devices.csv', default_interval=DEFAULT_INTERVAL, group_intervals=None,
+                 jitter=DEFAULT_JITTER, ssh_pool=None, explain=False, capture_state=False):
+        self.csv_file = csv_file
+        self.default_interval = default_interval
+        self.group_intervals = group_intervals or {}
+        self.jitter = jitter
+        self.ssh_pool = ssh_pool
+        self.explain = explain
+        self.capture_state = capture_state
+
+        self._devices = {}  # 设备标识 -> 设备信息
+        self._next_run = {}  # 设备标识 -> 下次执行时间（monotonic）
+        self._heap = []  # (下次执行时间, 设备标识)，过期条目在弹出时跳过
+        self._running = set()  # 正在备份的设备，避免定时任务与按需触发重叠
+        self._csv_mtime = None
+        self._cpu_pool = None  # CPU阶段进程池在各备份周期间复用
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+
+    def device_interval(self, device):
+        """返回设备的备份间隔（秒）"""
+        if device.get('interval'):
+            minutes = float(device['interval'])
+        else:
+            minutes = self.group_intervals.get(device.get('group', ''), self.default_interval)
+        return minutes * 60
+
+    def _schedule(self, key, delay):
+        run_at = time.monotonic() + delay
+        self._next_run[key] = run_at
+        heapq.heappush(self._heap, (run_at, key))
+
+    def _next_delay(self, device):
+        interval = self.device_interval(device)
+        return max(0, interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def reload_devices(self):
+        """devices.csv有变化时重新加载，新设备在一个间隔内随机分散首次执行"""
+        try:
+            mtime = os.path.getmtime(self.csv_file)
+        except OSError:
+            return
+        if mtime == self._csv_mtime:
+            return
+
+        devices = backup_config.load_devices_from_csv(self.csv_file)
+        with self._lock:
+            self._csv_mtime = mtime
+            self._devices = {device_key(device): device for device in devices}
+            for key in list(self._next_run):
+                if key not in self._devices:
+                    del self._next_run[key]
+            for key, device in self._devices.items():
+                if key not in self._next_run:
+                    self._schedule(key, random.uniform(0, self.device_interval(device) * self.jitter))
+        print(f"已加载 {len(self._devices)} 个设备: {self.csv_file}")
+
+    def _pop_due(self):
+        """取出所有已到期且未在执行的设备"""
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                run_at, key = heapq.heappop(self._heap)
+                if self._next_run.get(key) != run_at:
+                    continue  # 设备已移除或已重新调度
+                if key in self._running:
+                    self._schedule(key, RELOAD_CHECK_SECONDS)
+                    continue
+                self._running.add(key)
+                due.append(self._devices[key])
+        return due
+
+    def _seconds_until_next(self):
+        with self._lock:
+            if not self._heap:
+                return RELOAD_CHECK_SECONDS
+            return min(RELOAD_CHECK_SECONDS, max(0, self._heap[0][0] - time.monotonic()))
+
+    def _get_cpu_pool(self):
+        """返回复用的CPU阶段进程池，子进程异常退出（如被OOM终止）导致进程池损坏时重新创建"""
+        if self._cpu_pool is not None and self._cpu_pool._broken:
+            print(f"CPU阶段进程池已损坏，重新创建: {self._cpu_pool._broken}")
+            self._cpu_pool.shutdown(wait=False)
+            self._cpu_pool = None
+        if self._cpu_pool is None:
+            self._cpu_pool = backup_config.create_cpu_pool()
+        return self._cpu_pool
+
+    def close(self):
+        """关闭CPU阶段进程池"""
+        if self._cpu_pool is not None:
+            self._cpu_pool.shutdown()
+            self._cpu_pool = None
+
+    def run_cycle(self, devices):
+        """备份一批到期设备，完成后重新调度并执行diff解释"""
+        print(f"\n{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} 开始备份 {len(devices)} 个到期设备")
+        results = []
+        try:
+            results = backup_config.run_backup_pipeline(devices, ssh_pool=self.ssh_pool,
+                                                        capture_state=self.capture_state,
+                                                        cpu_pool=self._get_cpu_pool())
+            backup_config.write_summary_report(results)
+            self.explain_results(results)
+        except Exception as e:
+            print(f"备份周期执行失败: {str(e)}")
+        finally:
+            with self._lock:
+                for device in devices:
+                    key = device_key(device)
+                    self._running.discard(key)
+                    if key in self._devices:
+                        self._schedule(key, self._next_delay(self._devices[key]))
+            if self.ssh_pool is not None:
+                self.ssh_pool.close_idle()
+        return results
+
+    def backup_now(self, name):
+        """立即备份指定设备（设备名称或IP），返回处理结果"""
+        with self._lock:
+            device = self._devices.get(name)
+            if device is None:
+                device = next((d for d in self._devices.values() if d['hostname'] == name), None)
+            if device is None:
+                return {'status': 'not_found', 'device': name}
+            key = device_key(device)
+            if key in self._running:
+                return {'status': 'busy', 'device': name}
+            self._running.add(key)
+
+        try:
+            result = backup_config.process_device(device, self.ssh_pool, self.capture_state)
+            self.explain_results([result])
+            return result
+        finally:
+            with self._lock:
+                self._running.discard(key)
+                if key in self._devices:
+                    # 按需备份后重新计算下次定时执行时间
+                    self._schedule(key, self._next_delay(self._devices[key]))
+            self._wakeup.set()
+
+    def explain_results(self, results):
+        """对生成了diff文件的结果执行AI解释和飞书通知"""
+        if not self.explain:
+            return
+
+        # 仅在启用解释时才导入openai等依赖
+        import diff_explain
+
+        for result in results:
+            diff_file = result.get('diff_file')
+            if not diff_file:
+                continue
+            try:
+                diff_explain.explain_diff_report({
+                    'device_name': result.get('device_name') or result['hostname'],
+                    'file_path': diff_file,
+                    'timestamp': parse_diff_timestamp(diff_file)
+                })
+            except Exception as e:
+                print(f"设备 {result['hostname']} - 配置变更解释失败: {str(e)}")
+
+    def status(self):
+        """返回各设备的调度状态"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    'device': key,
+                    'hostname': device['hostname'],
+                    'interval_minutes': self.device_interval(device) / 60,
+                    'next_run_in_seconds': round(max(0, self._next_run.get(key, now) - now)),
+                    'running': key in self._running
+                }
+                for key, device in self._devices.items()
+            ]
+
+    def run_forever(self):
+        """调度主循环，直到stop被调用；遗留暂存文件只在启动时清理一次，不进入每个备份周期"""
+        stale = backup_config.clean_stale_spool_files()
+        if stale:
+            print(f"已清理 {stale} 个遗留的配置暂存文件")
+        try:
+            while not self._stop.is_set():
+                self.reload_devices()
+                due = self._pop_due()
+                if due:
+                    self.run_cycle(due)
+                    continue
+                self._wakeup.wait(self._seconds_until_next())
+                self._wakeup.clear()
+        finally:
+            self.close()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+def make_request_handler(scheduler):
+    """创建本地HTTP接口：GET /status 查看调度状态，POST /backup?device=名称 立即备份"""
+    class TriggerHandler(BaseHTTPRequestHandler):
+        def _send_json(self, code, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path == '/status':
+                self._send_json(200, scheduler.status())
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/backup':
+                self._send_json(404, {'error': 'not found'})
+                return
+            name = parse_qs(url.query).get('device', [''])[0]
+            if not name:
+                self._send_json(400, {'error': '缺少device参数'})
+                return
+            result = scheduler.backup_now(name)
+            code = {'not_found': 404, 'busy': 409}.get(result.get('status'), 200)
+            self._send_json(code, result)
+
+        def log_message(self, format, *args):
+            print(f"HTTP {self.address_string()} - {format % args}")
+
+    return TriggerHandler
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="配置备份守护进程")
+    parser.add_argument('--csv', default='devices.csv', help="设备CSV文件")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help="默认备份间隔（分钟）")
+    parser.add_argument('--group-interval', action='append', metavar='分组=分钟',
+                        help="按devices.csv的group列设置间隔，可多次指定")
+    parser.add_argument('--jitter', type=float, default=DEFAULT_JITTER, help="调度随机偏移比例")
+    parser.add_argument('--listen', default='127.0.0.1:8765', help="按需备份HTTP接口地址，空字符串表示不启用")
+    parser.add_argument('--keepalive', type=int, default=30,
+                        help="复用SSH会话并按此秒数发送keepalive，0表示每条命令新建连接")
+    parser.add_argument('--explain', action='store_true', help="备份后对新的diff报告执行AI解释")
+    parser.add_argument('--state', action='store_true', help="备份时同时采集设备运行状态")
+    args = parser.parse_args(argv)
+
+    ssh_pool = SSHSessionPool(keepalive_interval=args.keepalive) if args.keepalive > 0 else None
+    scheduler = BackupScheduler(args.csv, args.interval, parse_group_intervals(args.group_interval),
+                                args.jitter, ssh_pool, args.explain, args.state)
+
+    server = None
+    if args.listen:
+        host, _, port = args.listen.rpartition(':')
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), make_request_handler(scheduler))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"按需备份接口已启动: http://{host or '127.0.0.1'}:{port}")
+
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        print("\n收到中断信号，停止守护进程")
+    finally:
+        scheduler.stop()
+        if server is not None:
+            server.shutdown()
+        if ssh_pool is not None:
+            ssh_pool.close_all()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import os
+import re
+
+BACKUP_DIR = "backups"
+# backups目录下不属于设备的目录
+NON_DEVICE_DIRS = {'reports', 'diff_ai'}
+TIMESTAMP_PATTERN = re.compile(r'^\d{12}$')
+
+def list_devices(backup_dir=BACKUP_DIR):
+    """列出有备份记录的设备名称"""
+    if not os.path.isdir(backup_dir):
+        return []
+
+    return sorted(
+        d for d in os.listdir(backup_dir)
+        if not d.startswith('.') and d not in NON_DEVICE_DIRS and os.path.isdir(os.path.join(backup_dir, d))
+    )
+
+def list_versions(device_name, config_type='running', backup_dir=BACKUP_DIR, after=None):
+    """
+    按时间顺序列出设备某类配置的所有备份版本
+    :param after: 可选，只列出晚于该时间戳的版本，跳过的版本目录不会被访问
+    :return: [(年月日时分, 配置文件路径), ...]，从旧到新
+    """
+    config_type_dir = os.path.join(backup_dir, device_name, config_type)
+    if not os.path.isdir(config_type_dir):
+        return []
+
+    versions = []
+    suffix = f"_{config_type}.txt"
+    for timestamp in sorted(os.listdir(config_type_dir)):
+        if not TIMESTAMP_PATTERN.match(timestamp) or (after is not None and timestamp <= after):
+            continue
+        version_dir = os.path.join(config_type_dir, timestamp)
+        if not os.path.isdir(version_dir):
+            continue
+        for filename in sorted(os.listdir(version_dir)):
+            if filename.endswith(suffix):
+                versions.append((timestamp, os.path.join(version_dir, filename)))
+                break
+    return versions
+
+def find_version(device_name, config_type='running', timestamp=None, backup_dir=BACKUP_DIR):
+    """
+    查找指定时间点生效的备份版本
+    :param timestamp: 年月日时分，返回不晚于该时间的最新版本；为None时返回最新版本
+    :return: (年月日时分, 配置文件路径)，没有找到时返回None
+    """
+    versions = list_versions(device_name, config_type, backup_dir)
+    if timestamp is not None:
+        versions = [v for v in versions if v[0] <= timestamp]
+    return versions[-1] if versions else None
+
+def search_backups(pattern, config_type='running', device_name=None, ignore_case=False, backup_dir=BACKUP_DIR):
+    """
+    在各设备最新的备份中按正则搜索配置行
+    :return: 生成 (设备名称, 配置文件路径, 行号, 行内容)
+    """
+    regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+    devices = [device_name] if device_name else list_devices(backup_dir)
+
+    for device in devices:
+        latest = find_version(device, config_type, backup_dir=backup_dir)
+        if latest is None:
+            continue
+        with open(latest[1], 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if regex.search(line):
+                    yield device, latest[1], line_no, line.rstrip('\n')
@@ -0,0 +1,58 @@
+"""
+启动耗时基准：在没有待处理diff报告的空目录中反复运行 cli.py explain，统计进程总耗时，
+并用 -X importtime 列出导入最慢的模块，确认openai等依赖没有被加载
+  python bench_startup.py [--runs 20]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+
+def time_runs(command, runs, cwd):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def slowest_imports(command, cwd, top=10):
+    """解析 -X importtime 输出，返回累计耗时最长的模块"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + command[1:], cwd=cwd,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), module.strip()))
+    imports.sort(reverse=True)
+    return imports[:top], {module for _, module in imports}
+
+def main():
+    parser = argparse.ArgumentParser(description="CLI启动耗时基准")
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        baseline = time_runs([sys.executable, '-c', 'pass'], args.runs, workdir)
+        command = [sys.executable, CLI, 'explain']
+        timings = time_runs(command, args.runs, workdir)
+        top_imports, modules = slowest_imports(command, workdir)
+
+    print(f"空解释器启动:      中位数 {statistics.median(baseline):.1f} ms")
+    print(f"cli.py explain无任务: 中位数 {statistics.median(timings):.1f} ms, 最大 {max(timings):.1f} ms")
+    print("累计导入耗时最长的模块:")
+    for cumulative, module in top_imports:
+        print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+    heavy = sorted(m for m in ('openai', 'requests', 'paramiko', 'httpx', 'pydantic') if m in modules)
+    print(f"加载的重量级依赖: {', '.join(heavy) if heavy else '无'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+统一命令行入口
+  python cli.py backup [--profile] [--state] 执行一次配置备份，--state同时采集运行状态
+  python cli.py explain [--hours N] [--profile] 解释最近的diff报告并发送通知
+  python cli.py search 正则          在各设备最新备份中搜索配置行
+  python cli.py restore 设备         导出设备某个时间点的备份配置
+  python cli.py blame 设备           标注当前配置每一行由哪个备份版本引入
+  python cli.py similarity [...]    配置相似度聚类，报告离群设备
+  python cli.py state [...]         查询运行状态快照
+  python cli.py daemon [...]        守护进程模式
+  python cli.py queue [...]         分布式协调者/worker模式
+  python cli.py clean [--hours N]   清理崩溃遗留的暂存文件和空时间戳目录（遍历整个backups/，建议低频定时执行）
+各子命令只在执行时导入所需模块，openai、paramiko等较重的依赖不会拖慢其他子命令的启动
+"""
+import argparse
+import sys
+
+def cmd_backup(args):
+    import backup_config
+
+    backup_config.main(profile=args.profile, capture_state=args.state)
+
+def cmd_explain(args):
+    import diff_explain
+
+    diff_explain.main(hours=args.hours, profile=args.profile)
+
+def cmd_search(args):
+    import backup_store
+
+    matched = 0
+    for device_name, file_path, line_no, line in backup_store.search_backups(
+            args.pattern, args.type, args.device, args.ignore_case):
+        print(f"{device_name}:{file_path}:{line_no}: {line}")
+        matched += 1
+    if not matched:
+        print("没有匹配的配置行")
+        return 1
+
+def cmd_restore(args):
+    import backup_store
+
+    version = backup_store.find_version(args.device, args.type, args.at)
+    if version is None:
+        print(f"设备 {args.device} 没有找到{args.type}配置的备份")
+        return 1
+
+    with open(version[1], 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(content)
+        print(f"设备 {args.device} - 已导出 {version[0]} 的{args.type}配置到 {args.output}")
+    else:
+        sys.stdout.write(content)
+
+def cmd_blame(args):
+    import config_blame
+
+    return config_blame.main([args.device, '--type', args.type])
+
+def cmd_similarity(args):
+    import config_similarity
+
+    config_similarity.main(args.similarity_args)
+
+def cmd_state(args):
+    import state_capture
+
+    return state_capture.main(args.state_args)
+
+def cmd_daemon(args):
+    import backup_daemon
+
+    backup_daemon.main(args.daemon_args)
+
+def cmd_queue(args):
+    import work_queue
+
+    work_queue.main(args.queue_args)
+
+def cmd_clean(args):
+    import atomic_write
+    import backup_config
+
+    stale = atomic_write.clean_stale_temp_files("backups", max_age=args.hours * 3600)
+    spooled = backup_config.clean_stale_spool_files(max_age=args.hours * 3600)
+    print(f"已清理 {stale} 个未发布的暂存文件，{spooled} 个遗留的配置暂存文件")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="网络设备配置备份工具")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backup_parser = subparsers.add_parser('backup', help="执行一次配置备份")
+    backup_parser.add_argument('--profile', action='store_true', help="记录性能分析数据到 backups/reports/")
+    backup_parser.add_argument('--state', action='store_true', help="同时采集设备运行状态到 backups/state.db")
+    backup_parser.set_defaults(func=cmd_backup)
+
+    explain_parser = subparsers.add_parser('explain', help="解释最近的diff报告")
+    explain_parser.add_argument('--hours', type=float, default=1, help="处理最近多少小时内的报告")
+    explain_parser.add_argument('--profile', action='store_true', help="记录性能分析数据到 backups/reports/")
+    explain_parser.set_defaults(func=cmd_explain)
+
+    search_parser = subparsers.add_parser('search', help="在最新备份中搜索配置行")
+    search_parser.add_argument('pattern', help="正则表达式")
+    search_parser.add_argument('--device', help="只搜索指定设备")
+    search_parser.add_argument('--type', choices=['running', 'startup'], default='running')
+    search_parser.add_argument('-i', '--ignore-case', action='store_true')
+    search_parser.set_defaults(func=cmd_search)
+
+    restore_parser = subparsers.add_parser('restore', help="导出设备某个时间点的备份配置")
+    restore_parser.add_argument('device', help="设备名称")
+    restore_parser.add_argument('--type', choices=['running', 'startup'], default='startup')
+    restore_parser.add_argument('--at', help="年月日时分，取不晚于该时间的最新版本，默认最新")
+    restore_parser.add_argument('-o', '--output', help="输出文件，默认输出到标准输出")
+    restore_parser.set_defaults(func=cmd_restore)
+
+    blame_parser = subparsers.add_parser('blame', help="标注当前配置每一行由哪个备份版本引入")
+    blame_parser.add_argument('device', help="设备名称")
+    blame_parser.add_argument('--type', choices=['running', 'startup'], default='running')
+    blame_parser.set_defaults(func=cmd_blame)
+
+    similarity_parser = subparsers.add_parser('similarity', help="配置相似度聚类，参数同 config_similarity.py",
+                                              add_help=False)
+    similarity_parser.add_argument('similarity_args', nargs=argparse.REMAINDER)
+    similarity_parser.set_defaults(func=cmd_similarity)
+
+    state_parser = subparsers.add_parser('state', help="查询运行状态快照，参数同 state_capture.py", add_help=False)
+    state_parser.add_argument('state_args', nargs=argparse.REMAINDER)
+    state_parser.set_defaults(func=cmd_state)
+
+    daemon_parser = subparsers.add_parser('daemon', help="守护进程模式，参数同 backup_daemon.py", add_help=False)
+    daemon_parser.add_argument('daemon_args', nargs=argparse.REMAINDER)
+    daemon_parser.set_defaults(func=cmd_daemon)
+
+    queue_parser = subparsers.add_parser('queue', help="分布式模式，参数同 work_queue.py", add_help=False)
+    queue_parser.add_argument('queue_args', nargs=argparse.REMAINDER)
+    queue_parser.set_defaults(func=cmd_queue)
+
+    clean_parser = subparsers.add_parser('clean', help="清理崩溃遗留的暂存文件")
+    clean_parser.add_argument('--hours', type=float, default=24,
+                              help="只清理修改时间早于多少小时前的文件")
+    clean_parser.set_defaults(func=cmd_clean)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
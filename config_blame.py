@@ -0,0 +1,120 @@
+"""
+配置行溯源（blame）：标注设备当前配置的每一行由哪个备份版本（及对应的diff文件）引入
+每个设备每类配置维护一份增量标注缓存 backups/<设备>/<配置类型>/.blame.json，
+新版本保存后只需把新版本与缓存中的上一版本比对，不必回放全部历史；
+生成该版本的备份所产生的diff文件在更新缓存时一并记录
+  python config_blame.py 设备 [--type running|startup]
+"""
+import argparse
+import collections
+import json
+import os
+
+from atomic_write import WriteBatch
+from backup_store import BACKUP_DIR, list_versions
+
+BLAME_CACHE_FILE = ".blame.json"
+
+def annotate_version(previous, config_lines, timestamp):
+    """
+    根据上一版本的标注计算新版本的标注
+    与compare_configs一致按行内容（去除首尾空白）匹配，不受行顺序变化影响；
+    相同内容的重复行按出现顺序依次继承上一版本中最早的标注，多出的行记为本版本引入
+    :param previous: 上一版本的标注 [(版本时间戳, 行内容), ...]
+    :return: 新版本的标注 [(版本时间戳, 行内容), ...]
+    """
+    available = collections.defaultdict(collections.deque)
+    for version, line in previous:
+        available[line.strip()].append(version)
+
+    annotated = []
+    for line in config_lines:
+        versions = available.get(line.strip())
+        annotated.append((versions.popleft() if versions else timestamp, line))
+    return annotated
+
+def _cache_path(device_name, config_type, backup_dir):
+    return os.path.join(backup_dir, device_name, config_type, BLAME_CACHE_FILE)
+
+def load_blame_cache(device_name, config_type='running', backup_dir=BACKUP_DIR):
+    """读取标注缓存，不存在或损坏时返回None"""
+    try:
+        with open(_cache_path(device_name, config_type, backup_dir), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def update_blame(device_name, config_type='running', backup_dir=BACKUP_DIR, diff_files=None):
+    """
+    将标注缓存更新到最新备份版本，只处理缓存之后新增的版本
+    :param diff_files: 可选，{配置文件: diff文件}，为新增版本记录生成它的备份所产生的diff文件
+    :return: 缓存内容 {'version': 版本时间戳, 'file': 配置文件, 'lines': [[版本时间戳, 行内容], ...],
+             'diff_files': {版本时间戳: diff文件}}，没有备份时返回None
+    """
+    cache = load_blame_cache(device_name, config_type, backup_dir)
+    pending = list_versions(device_name, config_type, backup_dir, after=cache['version'] if cache else None)
+    if not pending:
+        return cache
+
+    lines = cache['lines'] if cache is not None else []
+    version_diffs = dict(cache.get('diff_files', {})) if cache is not None else {}
+    diff_files = {os.path.abspath(path): diff_file for path, diff_file in (diff_files or {}).items()}
+    for timestamp, config_file in pending:
+        with open(config_file, 'r', encoding='utf-8', newline='') as f:
+            lines = annotate_version(lines, f.read().splitlines(), timestamp)
+        if diff_files.get(os.path.abspath(config_file)):
+            version_diffs[timestamp] = diff_files[os.path.abspath(config_file)]
+
+    # 只保留当前配置中仍被引用的版本的diff文件
+    referenced = {version for version, _ in lines}
+    cache = {'version': pending[-1][0], 'file': pending[-1][1], 'lines': [list(item) for item in lines],
+             'diff_files': {version: path for version, path in version_diffs.items() if version in referenced}}
+    with WriteBatch() as batch:
+        batch.write_text(_cache_path(device_name, config_type, backup_dir), json.dumps(cache, ensure_ascii=False))
+    return cache
+
+def blame(device_name, config_type='running', backup_dir=BACKUP_DIR):
+    """
+    标注设备最新配置的每一行
+    :return: [{'line_no': 行号, 'line': 行内容, 'version': 引入该行的版本时间戳, 'diff_file': 对应的diff文件或None}, ...]
+    """
+    cache = update_blame(device_name, config_type, backup_dir)
+    if cache is None:
+        return []
+
+    diff_files = cache.get('diff_files', {})
+    return [{'line_no': line_no, 'line': line, 'version': version, 'diff_file': diff_files.get(version)}
+            for line_no, (version, line) in enumerate(cache['lines'], 1)]
+
+def update_results_blame(results, backup_dir=BACKUP_DIR):
+    """备份完成后为有新配置的设备更新标注缓存，失败不影响备份结果"""
+    for result in results:
+        if result.get('status') == 'failed':
+            continue
+        device_name = result.get('device_name') or result['hostname']
+        for config_type, key in (('running', 'running_config_file'), ('startup', 'startup_config_file')):
+            if not result.get(key):
+                continue
+            diff_files = {result[key]: result['diff_file']} if result.get('diff_file') else None
+            try:
+                update_blame(device_name, config_type, backup_dir, diff_files)
+            except Exception as e:
+                print(f"设备 {device_name} - 更新{config_type}配置溯源缓存失败: {str(e)}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="标注设备当前配置每一行的引入版本")
+    parser.add_argument('device', help="设备名称")
+    parser.add_argument('--type', choices=['running', 'startup'], default='running')
+    args = parser.parse_args(argv)
+
+    annotations = blame(args.device, args.type)
+    if not annotations:
+        print(f"设备 {args.device} 没有{args.type}配置的备份")
+        return 1
+
+    for item in annotations:
+        diff_name = item['diff_file'] or '-'
+        print(f"{item['version']} {diff_name} {item['line_no']:5d}) {item['line']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+"""
+全网配置相似度聚类与离群设备检测
+对每台设备最新运行配置的规范化行集合计算MinHash签名（NumPy向量化），签名保存在 backups/similarity.db，
+备份后只重新计算配置有变化的设备；分析时用LSH分桶找出相似设备并聚类，报告与所在簇共识配置
+（簇内过半设备都有的行）相似度偏低的设备，以及它们多出和缺少的配置行
+  python config_similarity.py [--min-similarity 0.95] [--max-lines 20] [--no-refresh]
+"""
+import argparse
+import datetime
+import hashlib
+import os
+import re
+import sqlite3
+
+import numpy as np
+
+from atomic_write import WriteBatch
+from backup_config import clean_config
+from backup_store import BACKUP_DIR, TIMESTAMP_PATTERN, list_devices
+
+SIMILARITY_DB = os.path.join(BACKUP_DIR, "similarity.db")
+# 规范化规则或行哈希变化时递增，旧版本的签名会被重新计算
+NORMALIZER_VERSION = 2
+NUM_PERM = 128
+# LSH分桶：16个band，每个band 8行，估计相似度约0.7以上的设备大概率落入同一个桶
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+# 同桶设备的估计相似度达到该值才合并为一簇
+CLUSTER_THRESHOLD = 0.8
+# 与所在簇共识配置的相似度（Jaccard）低于该值的设备报告为离群
+MIN_SIMILARITY = 0.95
+# 成员少于该数量的簇视为离群设备，归入最相近的大簇比较
+MIN_CLUSTER_SIZE = 3
+
+MERSENNE_PRIME = (1 << 61) - 1
+_rng = np.random.default_rng(20240601)
+# 行哈希折叠为32位后参与排列，a*x+b 不会超出uint64
+_PERM_A = _rng.integers(1, 1 << 32, NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 1 << 32, NUM_PERM, dtype=np.uint64)
+
+# 设备间本应不同的字段不参与比较
+NORMALIZE_RULES = [
+    (re.compile(r'^(sysname|description|snmp-agent sys-info (?:location|contact))\s.*$'), r'\1 <text>'),
+    (re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}\b'), '<ip>'),
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    device_name TEXT PRIMARY KEY,
+    config_file TEXT NOT NULL,
+    normalizer INTEGER NOT NULL,
+    signature BLOB NOT NULL,
+    line_hashes BLOB NOT NULL
+);
+"""
+
+def normalize_config(config):
+    """清理配置并屏蔽设备相关字段，返回规范化后的配置行集合"""
+    # 先去重再套用规则，配置中大量重复的接口子行只处理一次
+    lines = set(clean_config(config))
+    for pattern, replacement in NORMALIZE_RULES:
+        lines = {pattern.sub(replacement, line) for line in lines}
+    return lines
+
+def line_hash(line):
+    """配置行的64位哈希，全网数十万个不同配置行时32位哈希的碰撞不可忽略"""
+    return int.from_bytes(hashlib.blake2b(line.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def hash_lines(lines):
+    """返回行的64位哈希，已排序去重，用于共识配置和差异行集合"""
+    return np.unique(np.fromiter((line_hash(line) for line in lines), dtype=np.uint64, count=len(lines)))
+
+def minhash(line_hashes):
+    """计算MinHash签名，对所有排列一次性向量化计算；行哈希只在此处折叠为32位"""
+    if len(line_hashes) == 0:
+        return np.full(NUM_PERM, MERSENNE_PRIME, dtype=np.uint64)
+    folded = (line_hashes ^ (line_hashes >> np.uint64(32))) & np.uint64(0xFFFFFFFF)
+    values = (np.outer(_PERM_A, folded) + _PERM_B[:, None]) % MERSENNE_PRIME
+    return values.min(axis=1)
+
+def latest_running_file(device_name, backup_dir=BACKUP_DIR):
+    """返回设备最新的运行配置文件，只访问最新的版本目录"""
+    config_type_dir = os.path.join(backup_dir, device_name, "running")
+    if not os.path.isdir(config_type_dir):
+        return None
+
+    for timestamp in sorted(os.listdir(config_type_dir), reverse=True):
+        if not TIMESTAMP_PATTERN.match(timestamp):
+            continue
+        version_dir = os.path.join(config_type_dir, timestamp)
+        for filename in sorted(os.listdir(version_dir)):
+            if filename.endswith("_running.txt"):
+                return os.path.join(version_dir, filename)
+    return None
+
+class SignatureStore:
+    """设备签名的SQLite存储"""
+    def __init__(self, db_file=SIMILARITY_DB):
+        self.db_file = db_file
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_file, timeout=30)
+
+    def sources(self):
+        """返回 {设备名称: (配置文件, 规范化版本)}"""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT device_name, config_file, normalizer FROM signatures").fetchall()
+        finally:
+            conn.close()
+        return {device_name: (config_file, normalizer) for device_name, config_file, normalizer in rows}
+
+    def save(self, rows):
+        """写入 [(设备名称, 配置文件, 签名, 行哈希), ...]"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO signatures (device_name, config_file, normalizer, signature, line_hashes) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(device_name, config_file, NORMALIZER_VERSION, signature.tobytes(), line_hashes.tobytes())
+                     for device_name, config_file, signature, line_hashes in rows]
+                )
+        finally:
+            conn.close()
+
+    def remove(self, device_names):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("DELETE FROM signatures WHERE device_name = ?", [(name,) for name in device_names])
+        finally:
+            conn.close()
+
+    def load(self):
+        """
+        读取所有签名
+        :return: (设备名称列表, 配置文件列表, 签名矩阵[设备数, NUM_PERM], 各设备的行哈希数组列表)
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT device_name, config_file, signature, line_hashes FROM signatures "
+                                "ORDER BY device_name").fetchall()
+        finally:
+            conn.close()
+
+        device_names = [row[0] for row in rows]
+        config_files = [row[1] for row in rows]
+        signatures = np.frombuffer(b"".join(row[2] for row in rows), dtype=np.uint64).reshape(len(rows), NUM_PERM)
+        line_hashes = [np.frombuffer(row[3], dtype=np.uint64) for row in rows]
+        return device_names, config_files, signatures, line_hashes
+
+def update_signatures(device_names=None, store=None, backup_dir=BACKUP_DIR):
+    """
+    重新计算最新运行配置有变化的设备的签名
+    :param device_names: 要检查的设备，默认检查所有有备份的设备并清除已不存在的设备
+    :return: 重新计算的设备数量
+    """
+    store = store or SignatureStore()
+    sources = store.sources()
+    if device_names is None:
+        device_names = list_devices(backup_dir)
+        existing = set(device_names)
+        store.remove([name for name in sources if name not in existing])
+
+    rows = []
+    for device_name in device_names:
+        config_file = latest_running_file(device_name, backup_dir)
+        if config_file is None or sources.get(device_name) == (config_file, NORMALIZER_VERSION):
+            continue
+        with open(config_file, 'r', encoding='utf-8', newline='') as f:
+            line_hashes = hash_lines(normalize_config(f.read()))
+        rows.append((device_name, config_file, minhash(line_hashes), line_hashes))
+
+    if rows:
+        store.save(rows)
+    return len(rows)
+
+def update_results_signatures(results):
+    """备份完成后更新有新运行配置的设备的签名"""
+    device_names = [result.get('device_name') or result['hostname'] for result in results
+                    if result.get('status') != 'failed' and result.get('running_config_file')]
+    if device_names:
+        update_signatures(device_names)
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def cluster_signatures(signatures, threshold=CLUSTER_THRESHOLD):
+    """
+    LSH聚类：按band分桶，同桶且与桶内首个设备估计相似度达到阈值的设备合并
+    :return: 每个设备的簇编号数组
+    """
+    count = len(signatures)
+    parent = list(range(count))
+    if count == 0:
+        return np.array([], dtype=np.int64)
+
+    for band in range(LSH_BANDS):
+        rows = np.ascontiguousarray(signatures[:, band * LSH_ROWS:(band + 1) * LSH_ROWS])
+        keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * LSH_ROWS))).ravel()
+        _, first_index, bucket = np.unique(keys, return_index=True, return_inverse=True)
+        representative = first_index[bucket]
+        similarity = (signatures == signatures[representative]).mean(axis=1)
+        for i in np.nonzero((representative != np.arange(count)) & (similarity >= threshold))[0]:
+            root_a, root_b = _find(parent, i), _find(parent, representative[i])
+            if root_a != root_b:
+                parent[root_a] = root_b
+
+    roots = np.array([_find(parent, i) for i in range(count)])
+    return np.unique(roots, return_inverse=True)[1]
+
+def _consensus(line_hashes, members):
+    """簇内过半设备都有的行哈希"""
+    values, counts = np.unique(np.concatenate([line_hashes[i] for i in members]), return_counts=True)
+    return values[counts * 2 > len(members)]
+
+def _jaccard(line_hashes, members, consensus):
+    """各设备与共识配置的Jaccard相似度，向量化计算"""
+    sizes = np.array([len(line_hashes[i]) for i in members])
+    inside = np.isin(np.concatenate([line_hashes[i] for i in members]), consensus)
+    # 按成员序号累加，空配置的成员交集为0（reduceat遇到空段会取到下一个成员的值）
+    intersection = np.bincount(np.repeat(np.arange(len(members)), sizes), weights=inside, minlength=len(members))
+    union = sizes + len(consensus) - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1), 1.0)
+
+def _resolve_lines(hashes, config_files, limit):
+    """读取配置文件，把行哈希还原为配置行"""
+    wanted = set(int(h) for h in hashes[:limit])
+    resolved = {}
+    for config_file in config_files:
+        if len(resolved) == len(wanted):
+            break
+        with open(config_file, 'r', encoding='utf-8', newline='') as f:
+            for line in normalize_config(f.read()):
+                hashed = line_hash(line)
+                if hashed in wanted:
+                    resolved[hashed] = line
+    return sorted(resolved.values())
+
+def analyze_fleet(min_similarity=MIN_SIMILARITY, max_lines=20, refresh=True, store=None):
+    """
+    聚类全部设备并找出离群设备
+    :param refresh: 分析前先更新配置有变化的设备的签名
+    :return: {'clusters': [{'id', 'devices', 'consensus_lines'}, ...],
+              'outliers': [{'device_name', 'cluster', 'similarity', 'extra_lines', 'missing_lines'}, ...]}
+    """
+    store = store or SignatureStore()
+    if refresh:
+        updated = update_signatures(store=store)
+        print(f"已更新 {updated} 个设备的配置签名")
+
+    device_names, config_files, signatures, line_hashes = store.load()
+    labels = cluster_signatures(signatures)
+
+    members_by_cluster = {}
+    for i, label in enumerate(labels):
+        members_by_cluster.setdefault(int(label), []).append(i)
+    large = {label: members for label, members in members_by_cluster.items() if len(members) >= MIN_CLUSTER_SIZE}
+    consensus = {label: _consensus(line_hashes, members) for label, members in large.items()}
+
+    # 小簇中的设备都是离群设备，归入共识签名最相近的大簇比较
+    strays = {label: [] for label in large}
+    small = [i for label, members in members_by_cluster.items() if label not in large for i in members]
+    if small and large:
+        large_labels = list(large)
+        consensus_signatures = np.stack([minhash(consensus[label]) for label in large_labels])
+        estimated = (signatures[small][:, None, :] == consensus_signatures[None, :, :]).mean(axis=2)
+        for i, best in zip(small, estimated.argmax(axis=1)):
+            strays[large_labels[best]].append(i)
+
+    clusters, outliers = [], []
+    for cluster_id, (label, members) in enumerate(sorted(large.items(), key=lambda item: -len(item[1])), 1):
+        compared = members + strays[label]
+        similarities = _jaccard(line_hashes, compared, consensus[label])
+        clusters.append({'id': cluster_id, 'devices': [device_names[i] for i in members],
+                         'consensus_lines': len(consensus[label])})
+
+        # 用与共识最接近的几个成员还原缺少的行
+        reference_files = [config_files[members[j]] for j in np.argsort(-similarities[:len(members)])[:5]]
+        for position, (i, similarity) in enumerate(zip(compared, similarities)):
+            if position < len(members) and similarity >= min_similarity:
+                continue
+            extra = np.setdiff1d(line_hashes[i], consensus[label], assume_unique=True)
+            missing = np.setdiff1d(consensus[label], line_hashes[i], assume_unique=True)
+            outliers.append({
+                'device_name': device_names[i],
+                'cluster': cluster_id,
+                'similarity': float(similarity),
+                'extra_lines': _resolve_lines(extra, [config_files[i]], max_lines),
+                'extra_count': len(extra),
+                'missing_lines': _resolve_lines(missing, reference_files, max_lines),
+                'missing_count': len(missing),
+            })
+
+    outliers.sort(key=lambda item: item['similarity'])
+    return {'clusters': clusters, 'outliers': outliers, 'devices': len(device_names)}
+
+def format_report(analysis):
+    lines = [f"设备总数: {analysis['devices']}，簇数量: {len(analysis['clusters'])}，"
+             f"离群设备: {len(analysis['outliers'])}", ""]
+    for cluster in analysis['clusters']:
+        preview = ", ".join(cluster['devices'][:5]) + (" ..." if len(cluster['devices']) > 5 else "")
+        lines.append(f"簇 {cluster['id']}: {len(cluster['devices'])} 个设备，共识配置 {cluster['consensus_lines']} 行  "
+                     f"({preview})")
+
+    for outlier in analysis['outliers']:
+        lines.append("")
+        lines.append(f"离群设备 {outlier['device_name']}: 与簇 {outlier['cluster']} 共识配置相似度 "
+                     f"{outlier['similarity']:.1%}")
+        lines.append(f"  多出的配置行（共 {outlier['extra_count']} 行）:")
+        lines.extend(f"    + {line}" for line in outlier['extra_lines'])
+        lines.append(f"  缺少的配置行（共 {outlier['missing_count']} 行）:")
+        lines.extend(f"    - {line}" for line in outlier['missing_lines'])
+    return "\n".join(lines) + "\n"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="配置相似度聚类与离群设备检测")
+    parser.add_argument('--min-similarity', type=float, default=MIN_SIMILARITY,
+                        help="与簇共识配置的相似度低于该值时报告为离群设备")
+    parser.add_argument('--max-lines', type=int, default=20, help="每个离群设备最多列出的差异行数")
+    parser.add_argument('--no-refresh', action='store_true', help="不更新签名，直接使用已保存的签名")
+    args = parser.parse_args(argv)
+
+    analysis = analyze_fleet(args.min_similarity, args.max_lines, refresh=not args.no_refresh)
+    report = format_report(analysis)
+    print(report)
+
+    report_file = os.path.join(BACKUP_DIR, "reports",
+                               f"similarity_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.txt")
+    with WriteBatch() as batch:
+        batch.write_text(report_file, report)
+    print(f"相似度分析报告已保存到 {report_file}")
+
+if __name__ == '__main__':
+    main()
@@ -2,16 +2,26 @@ import os
 import glob
 import datetime
 import re
-import json
-import shutil
-from openai import OpenAI
-from feishu_hook import send_feishu_message
 
-# OpenAI客户端初始化
-client = OpenAI(
-  base_url="https://openrouter.ai/api/v1",
-  api_key="*******************",
-)
+import profiling
+
+# 飞书webhook URL
+FEISHU_WEBHOOK_URL = "https://open.feishu.cn/open-apis/bot/v2/hook/*******************"
+
+# OpenAI客户端在第一次需要解释时才创建，没有待处理报告时不导入openai
+_client = None
+
+def get_openai_client():
+    """延迟导入openai并初始化客户端"""
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        
+        _client = OpenAI(
+          base_url="https://openrouter.ai/api/v1",
+          api_key="*******************",
+        )
+    return _client
 
 def get_recent_diff_reports(hours=1):
     """
@@ -129,7 +139,7 @@ def get_ai_explanation(config_changes):
     
     try:
         # 调用OpenAI API
-        completion = client.chat.completions.create(
+        completion = get_openai_client().chat.completions.create(
             extra_headers={
                 "HTTP-Referer": "",
                 "X-Title": "",
@@ -197,64 +207,93 @@ def save_to_diff_ai(device_name, timestamp, diff_content, ai_explanation):
     
     return combined_file
 
-def main():
-    # 飞书webhook URL
-    webhook_url = "https://open.feishu.cn/open-apis/bot/v2/hook/*******************"
-    
-    # 获取最近一小时的diff报告
-    recent_reports = get_recent_diff_reports(hours=1)
-    
-    if not recent_reports:
-        print("未找到最近一小时内的配置变更报告")
-        return
+def explain_diff_report(report, webhook_url=FEISHU_WEBHOOK_URL):
+    """
+    解释单个diff报告：提取变化、获取AI解释、保存到diff_ai并发送飞书通知
+    :param report: 包含device_name、file_path、timestamp的报告信息
+    :param webhook_url: 飞书webhook URL
+    :return: 合并文件路径，没有有效变化时返回None
+    """
+    device_name = report['device_name']
+    file_path = report['file_path']
+    timestamp = report['timestamp']
     
-    print(f"找到 {len(recent_reports)} 个最近一小时内的配置变更报告")
+    print(f"处理设备 {device_name} 的配置变更报告...")
     
-    # 处理每个报告
-    for report in recent_reports:
-        device_name = report['device_name']
-        file_path = report['file_path']
-        timestamp = report['timestamp']
-        
-        print(f"处理设备 {device_name} 的配置变更报告...")
-        
-        # 读取diff内容
+    # 读取diff内容
+    with profiling.phase(device_name, "read"):
         diff_content = read_diff_content(file_path)
-        
-        # 提取配置变化
+    
+    # 提取配置变化
+    with profiling.phase(device_name, "extract"):
         config_changes = extract_config_changes(diff_content)
-        
-        # 如果没有配置变化，跳过
-        if not config_changes["running_changes"] and not config_changes["startup_changes"]:
-            print(f"设备 {device_name} 没有有效的配置变化，跳过")
-            continue
-        
-        # 获取AI解释
+    
+    # 如果没有配置变化，跳过
+    if not config_changes["running_changes"] and not config_changes["startup_changes"]:
+        print(f"设备 {device_name} 没有有效的配置变化，跳过")
+        return None
+    
+    # 获取AI解释
+    with profiling.phase(device_name, "llm"):
         ai_explanation = get_ai_explanation(config_changes)
-        
-        # 保存到diff_ai文件夹
+    
+    # 保存到diff_ai文件夹
+    with profiling.phase(device_name, "save"):
         combined_file = save_to_diff_ai(device_name, timestamp, diff_content, ai_explanation)
+    
+    # 构建消息
+    message = f"设备 {device_name} 配置变化解释\n"
+    message += f"时间: {timestamp.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+    message += "原始配置变化:\n"
+    message += "=" * 30 + "\n"
+    message += diff_content
+    message += "\n\n"
+    message += "AI解释:\n"
+    message += "=" * 30 + "\n"
+    message += ai_explanation
+    
+    # 发送消息
+    try:
+        from feishu_hook import send_feishu_message
         
-        # 构建消息
-        message = f"设备 {device_name} 配置变化解释\n"
-        message += f"时间: {timestamp.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-        message += "原始配置变化:\n"
-        message += "=" * 30 + "\n"
-        message += diff_content
-        message += "\n\n"
-        message += "AI解释:\n"
-        message += "=" * 30 + "\n"
-        message += ai_explanation
-        
-        # 发送消息
-        try:
+        with profiling.phase(device_name, "notify"):
             response = send_feishu_message(webhook_url, message)
-            if response.status_code == 200:
-                print(f"已成功发送 {device_name} 的配置变更通知和解释")
-            else:
-                print(f"发送 {device_name} 的配置变更通知和解释失败: {response.status_code} {response.text}")
-        except Exception as e:
-            print(f"发送 {device_name} 的配置变更通知和解释时出错: {str(e)}")
+        if response.status_code == 200:
+            print(f"已成功发送 {device_name} 的配置变更通知和解释")
+        else:
+            print(f"发送 {device_name} 的配置变更通知和解释失败: {response.status_code} {response.text}")
+    except Exception as e:
+        print(f"发送 {device_name} 的配置变更通知和解释时出错: {str(e)}")
+    
+    return combined_file
+
+def main(hours=1, profile=False):
+    """解释最近的diff报告，profile为True时记录性能分析数据并写入 backups/reports/"""
+    if profile:
+        profiling.enable()
+    try:
+        explain_recent_reports(hours)
+    finally:
+        profiling.finish("explain")
+
+def explain_recent_reports(hours=1):
+    # 获取最近一段时间（默认一小时）的diff报告
+    with profiling.phase(None, "scan"):
+        recent_reports = get_recent_diff_reports(hours=hours)
+    
+    if not recent_reports:
+        print(f"未找到最近{hours}小时内的配置变更报告")
+        return
+    
+    print(f"找到 {len(recent_reports)} 个最近{hours}小时内的配置变更报告")
+    
+    # 处理每个报告
+    for report in recent_reports:
+        explain_diff_report(report)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="解释最近的配置变更报告")
+    parser.add_argument('--profile', action='store_true', help="记录各设备各阶段的性能分析数据")
+    main(profile=parser.parse_args().profile)
\ No newline at end of file
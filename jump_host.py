@@ -0,0 +1,150 @@
+import csv
+import os
+import threading
+import time
+
+import paramiko
+
+import backup_config
+
+BASTIONS_CSV = 'bastions.csv'
+DEFAULT_MAX_CHANNELS = 10  # 每台跳板机默认允许的并发设备通道数
+DEFAULT_SLOT_TIMEOUT = 300  # 等待通道名额的最长时间（秒），超时后报错
+
+class TunneledSSHClient(paramiko.SSHClient):
+    """经跳板机通道建立的设备SSH客户端，关闭时归还跳板机的通道名额"""
+    def __init__(self, release):
+        super().__init__()
+        self._release = release
+
+    def close(self):
+        super().close()
+        if self._release is not None:
+            release, self._release = self._release, None
+            release()
+
+class Bastion:
+    """
+    跳板机：所有经过它的设备共享一个已认证的Transport，
+    每个设备会话是其上的一个direct-tcpip通道，并发通道数不超过max_channels
+    会话关闭时归还通道名额；名额用尽时先请求已注册的连接池关闭经本跳板机的空闲会话，再等待
+    """
+    def __init__(self, name, hostname, username, password, port=22, max_channels=DEFAULT_MAX_CHANNELS,
+                 slot_timeout=DEFAULT_SLOT_TIMEOUT):
+        self.name = name
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.port = port
+        self.slot_timeout = slot_timeout
+        self._client = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_channels)
+        self._reclaimers = []  # 回调函数，关闭一个经本跳板机的空闲会话，成功时返回True
+
+    def add_reclaimer(self, reclaim):
+        """注册回收空闲会话的回调（如连接池），同一回调只注册一次"""
+        with self._lock:
+            if reclaim not in self._reclaimers:
+                self._reclaimers.append(reclaim)
+
+    def _acquire_slot(self):
+        """获取通道名额，名额用尽时回收空闲会话，超过slot_timeout仍未获取到时抛出异常"""
+        deadline = time.monotonic() + self.slot_timeout
+        while not self._slots.acquire(blocking=False):
+            with self._lock:
+                reclaimers = list(self._reclaimers)
+            # 回收的会话关闭时归还名额，不必等待
+            if any(reclaim(self.name) for reclaim in reclaimers):
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"跳板机 {self.name} 的通道名额已用尽，等待 {self.slot_timeout} 秒后超时")
+            # 使用中的会话可能随时变为空闲，定期重新尝试回收
+            if self._slots.acquire(timeout=min(1, remaining)):
+                return
+
+    def _get_transport(self):
+        """返回到跳板机的Transport，断开时重新连接"""
+        with self._lock:
+            transport = self._client.get_transport() if self._client is not None else None
+            if transport is None or not transport.is_active():
+                if self._client is not None:
+                    self._client.close()
+                print(f"连接跳板机 {self.name}({self.hostname})")
+                self._client = backup_config.connect_device(self.hostname, self.username, self.password, self.port)
+                transport = self._client.get_transport()
+                transport.set_keepalive(30)
+            return transport
+
+    def connect(self, hostname, username, password, port, timeout=30):
+        """经跳板机连接设备，返回已认证的SSH客户端；通道名额用尽时回收空闲会话或等待其他会话关闭"""
+        self._acquire_slot()
+        ssh_client = None
+        try:
+            channel = self._get_transport().open_channel('direct-tcpip', (hostname, port), ('127.0.0.1', 0),
+                                                         timeout=timeout)
+            ssh_client = TunneledSSHClient(self._slots.release)
+            ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            ssh_client.connect(
+                hostname,
+                port=port,
+                username=username,
+                password=password,
+                sock=channel,
+                timeout=timeout,
+                allow_agent=False,
+                look_for_keys=False
+            )
+            return ssh_client
+        except Exception:
+            if ssh_client is not None:
+                ssh_client.close()
+            else:
+                self._slots.release()
+            raise
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+_bastions = None
+_bastions_lock = threading.Lock()
+
+def load_bastions_from_csv(csv_file=BASTIONS_CSV):
+    """从CSV文件加载跳板机信息，列为 name,hostname,port,username,password,max_channels,slot_timeout"""
+    bastions = {}
+    if not os.path.exists(csv_file):
+        return bastions
+
+    with open(csv_file, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            bastions[row['name']] = Bastion(
+                row['name'],
+                row['hostname'],
+                row['username'],
+                row['password'],
+                port=int(row['port']) if row.get('port') else 22,
+                max_channels=int(row['max_channels']) if row.get('max_channels') else DEFAULT_MAX_CHANNELS,
+                slot_timeout=float(row['slot_timeout']) if row.get('slot_timeout') else DEFAULT_SLOT_TIMEOUT
+            )
+    return bastions
+
+def get_bastion(name):
+    """按devices.csv中via列的名称返回跳板机，首次调用时加载bastions.csv"""
+    global _bastions
+    with _bastions_lock:
+        if _bastions is None:
+            _bastions = load_bastions_from_csv()
+        bastion = _bastions.get(name)
+    if bastion is None:
+        raise ValueError(f"未定义的跳板机: {name}，请在 {BASTIONS_CSV} 中添加")
+    return bastion
+
+def close_all():
+    """关闭所有跳板机连接"""
+    with _bastions_lock:
+        for bastion in (_bastions or {}).values():
+            bastion.close()
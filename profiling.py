@@ -0,0 +1,204 @@
+"""
+性能分析模式（--profile）
+使用 sys.setprofile/threading.setprofile 记录所有线程的调用栈耗时，按 设备/阶段 归类，
+同时用 tracemalloc 记录每个阶段的内存峰值；运行结束后在 backups/reports/ 下生成
+  profile_<脚本>_<时间>.folded  火焰图工具（flamegraph.pl、speedscope等）可直接读取的折叠栈，单位微秒
+  profile_<脚本>_<时间>.txt     按自身耗时和累计耗时排序的热点函数、各阶段耗时和内存峰值
+未启用时 phase() 只做一次全局变量判断，几乎没有额外开销
+"""
+import collections
+import contextlib
+import datetime
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from atomic_write import WriteBatch
+
+DEFAULT_TOP_N = 30
+
+_profiler = None
+_null_phase = contextlib.nullcontext()
+
+def _frame_name(frame, event, arg):
+    """生成折叠栈中的函数名（不能包含分号）"""
+    if event == 'call':
+        code = frame.f_code
+        name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    else:
+        module = getattr(arg, '__module__', None) or 'builtins'
+        name = f"{module}.{getattr(arg, '__qualname__', repr(arg))}"
+    return name.replace(';', ',')
+
+class RunProfiler:
+    """记录一次运行的调用栈耗时和各阶段统计"""
+    def __init__(self):
+        self.stacks = collections.Counter()  # (阶段标签, 函数, ...) -> 自身耗时（秒）
+        self.phases = {}  # 阶段标签 -> {'seconds': 总耗时, 'count': 次数, 'peak': 内存峰值}
+        self._thread_stacks = []  # 各线程的Counter，结束时合并，避免记录时加锁
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _thread_state(self):
+        local = self._local
+        if not hasattr(local, 'calls'):
+            local.calls = []  # [函数名, 开始时间, 子调用耗时]
+            local.labels = ['(未归类)']
+            local.counter = collections.Counter()
+            with self._lock:
+                self._thread_stacks.append(local.counter)
+        return local
+
+    def _trace(self, frame, event, arg):
+        local = self._thread_state()
+        now = time.perf_counter()
+        if event == 'call' or event == 'c_call':
+            local.calls.append([_frame_name(frame, event, arg), now, 0.0])
+        elif local.calls:
+            # return / c_return / c_exception
+            name, start, child = local.calls.pop()
+            elapsed = now - start
+            if local.calls:
+                local.calls[-1][2] += elapsed
+            key = (local.labels[-1],) + tuple(call[0] for call in local.calls) + (name,)
+            local.counter[key] += elapsed - child
+
+    def start(self):
+        tracemalloc.start()
+        threading.setprofile(self._trace)
+        sys.setprofile(self._trace)
+
+    def stop(self):
+        sys.setprofile(None)
+        threading.setprofile(None)
+        with self._lock:
+            for counter in self._thread_stacks:
+                self.stacks.update(counter)
+                counter.clear()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    @contextlib.contextmanager
+    def phase(self, device, name):
+        label = f"{device}/{name}" if device else name
+        local = self._thread_state()
+        local.labels.append(label)
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            local.labels.pop()
+            with self._lock:
+                stats = self.phases.setdefault(label, {'seconds': 0.0, 'count': 0, 'peak': 0})
+                stats['seconds'] += seconds
+                stats['count'] += 1
+                stats['peak'] = max(stats['peak'], peak)
+
+    def drain(self):
+        """停止记录并返回可序列化的数据，用于从子进程传回主进程"""
+        self.stop()
+        data = {'stacks': dict(self.stacks), 'phases': self.phases}
+        self.stacks = collections.Counter()
+        self.phases = {}
+        self.start()
+        return data
+
+    def merge(self, data):
+        """合并子进程返回的数据"""
+        with self._lock:
+            self.stacks.update(data['stacks'])
+            for label, stats in data['phases'].items():
+                merged = self.phases.setdefault(label, {'seconds': 0.0, 'count': 0, 'peak': 0})
+                merged['seconds'] += stats['seconds']
+                merged['count'] += stats['count']
+                merged['peak'] = max(merged['peak'], stats['peak'])
+
+def is_enabled():
+    return _profiler is not None
+
+def enable():
+    """开启性能分析"""
+    global _profiler
+    _profiler = RunProfiler()
+    _profiler.start()
+
+def start_worker():
+    """进程池初始化函数：在子进程中开启性能分析"""
+    enable()
+
+def phase(device, name):
+    """标记一个设备的处理阶段，未开启性能分析时为空操作"""
+    if _profiler is None:
+        return _null_phase
+    return _profiler.phase(device, name)
+
+def wrap(device, name, func):
+    """返回在指定阶段中执行func的函数，用于提交到线程池的任务；未开启时直接返回func"""
+    if _profiler is None:
+        return func
+
+    def run(*args, **kwargs):
+        with _profiler.phase(device, name):
+            return func(*args, **kwargs)
+    return run
+
+def drain():
+    """取出子进程中已记录的数据，未开启时返回None"""
+    return _profiler.drain() if _profiler is not None else None
+
+def merge(data):
+    if _profiler is not None and data:
+        _profiler.merge(data)
+
+def format_report(stacks, phases, total_peak, top_n=DEFAULT_TOP_N):
+    """生成热点函数和阶段统计的文本报告"""
+    self_times = collections.Counter()
+    cumulative_times = collections.Counter()
+    for key, seconds in stacks.items():
+        self_times[key[-1]] += seconds
+        for name in set(key[1:]):
+            cumulative_times[name] += seconds
+
+    lines = [f"内存峰值: {total_peak / 1024 / 1024:.1f} MiB", ""]
+    lines.append(f"自身耗时最长的 {top_n} 个函数:")
+    for name, seconds in self_times.most_common(top_n):
+        lines.append(f"  {seconds:10.4f}s  {name}")
+
+    lines.append("")
+    lines.append(f"累计耗时最长的 {top_n} 个函数:")
+    for name, seconds in cumulative_times.most_common(top_n):
+        lines.append(f"  {seconds:10.4f}s  {name}")
+
+    lines.append("")
+    lines.append("各设备/阶段耗时（并发阶段的内存峰值为同一时段内的进程峰值）:")
+    for label, stats in sorted(phases.items(), key=lambda item: item[1]['seconds'], reverse=True):
+        lines.append(f"  {stats['seconds']:10.4f}s  {stats['count']:4d}次  "
+                     f"峰值 {stats['peak'] / 1024 / 1024:8.1f} MiB  {label}")
+    return "\n".join(lines) + "\n"
+
+def finish(script_name, top_n=DEFAULT_TOP_N):
+    """停止性能分析，将折叠栈和热点报告写入 backups/reports/"""
+    global _profiler
+    if _profiler is None:
+        return None
+
+    profiler, _profiler = _profiler, None
+    total_peak = profiler.stop()
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    base = os.path.join("backups", "reports", f"profile_{script_name}_{timestamp}")
+    folded = "".join(f"{';'.join(key)} {round(seconds * 1e6)}\n"
+                     for key, seconds in profiler.stacks.items() if seconds > 0)
+
+    with WriteBatch() as batch:
+        batch.write_text(base + ".folded", folded)
+        batch.write_text(base + ".txt", format_report(profiler.stacks, profiler.phases, total_peak, top_n))
+
+    print(f"\n性能分析结果已保存到 {base}.txt 和 {base}.folded")
+    return base
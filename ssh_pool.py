@@ -0,0 +1,102 @@
+import threading
+import time
+
+from backup_config import connect_device
+
+class SSHSessionPool:
+    """
+    SSH会话池：按设备缓存已认证的SSH连接，供多次命令和多个备份周期复用
+    缓存的连接定期发送keepalive，空闲超过idle_timeout秒的连接由close_idle关闭
+    get取出的连接在release之前视为使用中；经跳板机的连接占用跳板机通道名额，
+    名额用尽时跳板机会请求连接池关闭经同一跳板机的空闲连接
+    """
+    def __init__(self, keepalive_interval=30, idle_timeout=900):
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+        # (hostname, port, username) -> {'client', 'last_used': 上次使用时间, 'in_use': 使用次数, 'via': 跳板机名称}
+        self._sessions = {}
+        self._connect_locks = {}  # 每个设备一把锁，避免并发请求重复建立连接
+        self._lock = threading.Lock()
+
+    def get(self, hostname, username, password, port, via=None):
+        """
+        返回可用的SSH客户端，连接不存在或已断开时重新连接（via为跳板机名称）
+        使用完毕后必须调用release，出错时调用discard
+        """
+        key = (hostname, port, username)
+        with self._lock:
+            connect_lock = self._connect_locks.setdefault(key, threading.Lock())
+
+        with connect_lock:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is not None:
+                    session['in_use'] += 1
+
+            if session is not None:
+                transport = session['client'].get_transport()
+                if transport is not None and transport.is_active():
+                    session['last_used'] = time.monotonic()
+                    return session['client']
+                # 连接已断开，丢弃后重新建立
+                self.discard(hostname, username, port)
+
+            if via:
+                from jump_host import get_bastion
+
+                get_bastion(via).add_reclaimer(self.reclaim_idle)
+            ssh_client = connect_device(hostname, username, password, port, via)
+            if self.keepalive_interval:
+                ssh_client.get_transport().set_keepalive(self.keepalive_interval)
+
+            with self._lock:
+                self._sessions[key] = {'client': ssh_client, 'last_used': time.monotonic(), 'in_use': 1, 'via': via}
+            return ssh_client
+
+    def release(self, hostname, username, port):
+        """归还get取出的连接，连接保留在池中供下次使用"""
+        with self._lock:
+            session = self._sessions.get((hostname, port, username))
+            if session is not None and session['in_use'] > 0:
+                session['in_use'] -= 1
+                session['last_used'] = time.monotonic()
+
+    def discard(self, hostname, username, port):
+        """关闭并移除指定设备的连接，通常在命令执行出错后调用"""
+        with self._lock:
+            session = self._sessions.pop((hostname, port, username), None)
+        if session is not None:
+            session['client'].close()
+
+    def reclaim_idle(self, via):
+        """关闭一个经指定跳板机、最久未使用的空闲连接以归还通道名额，没有空闲连接时返回False"""
+        with self._lock:
+            idle = [(session['last_used'], key) for key, session in self._sessions.items()
+                    if session['via'] == via and session['in_use'] == 0]
+            if not idle:
+                return False
+            session = self._sessions.pop(min(idle)[1])
+
+        session['client'].close()
+        return True
+
+    def close_idle(self):
+        """关闭空闲超时的连接，返回关闭的数量"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, session in self._sessions.items()
+                       if session['in_use'] == 0 and now - session['last_used'] > self.idle_timeout]
+            sessions = [self._sessions.pop(key) for key in expired]
+
+        for session in sessions:
+            session['client'].close()
+        return len(sessions)
+
+    def close_all(self):
+        """关闭所有连接"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+
+        for session in sessions:
+            session['client'].close()
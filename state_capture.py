@@ -0,0 +1,194 @@
+"""
+设备运行状态快照：在备份会话中执行按厂商定义的状态命令，用TextFSM（ntc_templates模板）解析后
+按列存入 backups/state.db，全网状态查询直接读表，无需重新解析命令输出
+每条命令一张表（表名为模板名，如 huawei_vrp_display_interface_brief），列为模板字段，
+snapshot_id 关联 snapshots 表；latest_<表名> 视图只包含每台设备最近一次快照的数据
+  python cli.py backup --state                           备份时同时采集状态
+  python state_capture.py tables                         列出状态表
+  python state_capture.py query "SELECT ... FROM latest_huawei_vrp_display_interface_brief"
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+
+STATE_DB = os.path.join("backups", "state.db")
+# 设备类型 -> (ntc_templates平台名, 状态命令)，命令需有对应的ntc_templates模板
+# 华三（hp_comware）没有display version模板，改用display device manuinfo获取型号和序列号
+STATE_COMMANDS = {
+    'huawei': ('huawei_vrp', ['display version', 'display interface brief', 'display lldp neighbor']),
+    'h3c': ('hp_comware', ['display device manuinfo', 'display interface brief',
+                           'display lldp neighbor-information list']),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_name TEXT NOT NULL,
+    hostname TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    captured_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS latest (
+    device_name TEXT PRIMARY KEY,
+    snapshot_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parse_errors (
+    snapshot_id INTEGER NOT NULL,
+    command TEXT NOT NULL,
+    error TEXT NOT NULL
+);
+"""
+
+_cli_table = None
+
+def _get_cli_table():
+    """每个进程只加载一次ntc_templates索引"""
+    global _cli_table
+    if _cli_table is None:
+        # textfsm和ntc_templates只在解析时导入
+        import ntc_templates
+        from textfsm import clitable
+
+        template_dir = os.environ.get("NTC_TEMPLATES_DIR") or os.path.join(
+            os.path.dirname(ntc_templates.__file__), "templates")
+        _cli_table = clitable.CliTable("index", template_dir)
+    return _cli_table
+
+PROMPT_PATTERN = re.compile(r'^\s*(<[^<>]+>|\[[^\[\]]+\])')
+
+def strip_prompt_lines(output):
+    """移除命令回显和提示符行（<设备名>、[设备名]），TextFSM模板遇到这些行会报错"""
+    return "\n".join(line for line in output.splitlines() if not PROMPT_PATTERN.match(line)) + "\n"
+
+def parse_state_outputs(platform, outputs):
+    """
+    CPU阶段：用TextFSM模板解析各命令输出，可在进程池中执行
+    :param outputs: {命令: 输出}
+    :return: ({命令: {'columns': [字段名, ...], 'rows': [[值, ...], ...]}}, {命令: 错误信息})
+    """
+    cli_table = _get_cli_table()
+    tables, errors = {}, {}
+    for command, output in outputs.items():
+        try:
+            cli_table.ParseCmd(strip_prompt_lines(output), {'Command': command, 'Platform': platform})
+        except Exception as e:
+            errors[command] = str(e)
+            continue
+        # 多值字段（TextFSM的List）序列化为JSON字符串
+        tables[command] = {
+            'columns': [column.lower() for column in cli_table.header],
+            'rows': [[json.dumps(value, ensure_ascii=False) if isinstance(value, list) else value for value in row]
+                     for row in cli_table],
+        }
+    return tables, errors
+
+def table_name(platform, command):
+    """状态表名，与ntc_templates模板名一致"""
+    return re.sub(r'[^0-9a-zA-Z]+', '_', f"{platform}_{command}").strip('_').lower()
+
+class StateStore:
+    """状态快照的SQLite存储，写入由主进程在一次运行结束时统一提交"""
+    def __init__(self, db_file=STATE_DB):
+        self.db_file = db_file
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _ensure_table(self, conn, name, columns):
+        """创建状态表和最新快照视图，模板新增字段时补充列"""
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{name}" (snapshot_id INTEGER NOT NULL)')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}_snapshot" ON "{name}" (snapshot_id)')
+        existing = {row['name'] for row in conn.execute(f'PRAGMA table_info("{name}")')}
+        for column in columns:
+            if column not in existing:
+                conn.execute(f'ALTER TABLE "{name}" ADD COLUMN "{column}" TEXT')
+        conn.execute(f'CREATE VIEW IF NOT EXISTS "latest_{name}" AS '
+                     f'SELECT s.device_name, s.captured_at, t.* FROM "{name}" t '
+                     f'JOIN latest l ON l.snapshot_id = t.snapshot_id '
+                     f'JOIN snapshots s ON s.snapshot_id = t.snapshot_id')
+
+    def save_snapshots(self, snapshots):
+        """
+        在一个事务中写入多个设备的快照
+        :param snapshots: [{'device_name', 'hostname', 'platform', 'captured_at', 'tables', 'errors'}, ...]
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                for snapshot in snapshots:
+                    cursor = conn.execute(
+                        "INSERT INTO snapshots (device_name, hostname, platform, captured_at) VALUES (?, ?, ?, ?)",
+                        (snapshot['device_name'], snapshot['hostname'], snapshot['platform'], snapshot['captured_at'])
+                    )
+                    snapshot_id = cursor.lastrowid
+                    for command, table in snapshot['tables'].items():
+                        name = table_name(snapshot['platform'], command)
+                        self._ensure_table(conn, name, table['columns'])
+                        column_list = ", ".join(f'"{column}"' for column in ['snapshot_id'] + table['columns'])
+                        placeholders = ", ".join("?" * (len(table['columns']) + 1))
+                        conn.executemany(f'INSERT INTO "{name}" ({column_list}) VALUES ({placeholders})',
+                                         [[snapshot_id] + row for row in table['rows']])
+                    conn.executemany("INSERT INTO parse_errors (snapshot_id, command, error) VALUES (?, ?, ?)",
+                                     [(snapshot_id, command, error) for command, error in snapshot['errors'].items()])
+                    conn.execute("INSERT OR REPLACE INTO latest (device_name, snapshot_id) VALUES (?, ?)",
+                                 (snapshot['device_name'], snapshot_id))
+        finally:
+            conn.close()
+
+    def tables(self):
+        """列出已有的状态表"""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                "AND name NOT IN ('snapshots', 'latest', 'parse_errors') "
+                                "AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()
+        finally:
+            conn.close()
+        return [row['name'] for row in rows]
+
+    def query(self, sql, params=()):
+        """执行SQL查询，返回 (列名, 行列表)"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            columns = [item[0] for item in cursor.description or []]
+            return columns, [tuple(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查询设备运行状态快照")
+    parser.add_argument('--db', default=STATE_DB)
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    subparsers.add_parser('tables', help="列出状态表")
+    query_parser = subparsers.add_parser('query', help="执行SQL查询")
+    query_parser.add_argument('sql')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"状态数据库 {args.db} 不存在，请先执行 python cli.py backup --state")
+        return 1
+
+    store = StateStore(args.db)
+    if args.action == 'tables':
+        for name in store.tables():
+            print(name)
+        return
+
+    columns, rows = store.query(args.sql)
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row))
+
+if __name__ == '__main__':
+    main()
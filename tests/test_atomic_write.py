@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+import atomic_write
+import backup_config
+from atomic_write import WriteBatch, clean_stale_temp_files
+
+HOSTNAME = '10.0.0.1'
+DEVICE = 'sw1'
+
+def _publish(config_type, timestamp, content):
+    path = os.path.join("backups", DEVICE, config_type, timestamp, f"{HOSTNAME}_{config_type}.txt")
+    with WriteBatch() as batch:
+        batch.write_text(path, content)
+    return path
+
+def _temp_files(root):
+    return [name for _, _, names in os.walk(root) for name in names if atomic_write.TEMP_FILE_PATTERN.match(name)]
+
+def test_failed_commit_keeps_last_complete_version(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    old_running = _publish("running", "202601010000", "sysname A\r\n")
+    old_startup = _publish("startup", "202601010000", "sysname A\r\n")
+
+    # 本次运行暂存两个文件，第二次rename时失败
+    batch = WriteBatch()
+    backup_config.save_config_to_file(HOSTNAME, "running", "sysname B\r\n", DEVICE, batch)
+    new_startup = backup_config.save_config_to_file(HOSTNAME, "startup", "sysname B\r\n", DEVICE, batch)
+    real_replace = os.replace
+    calls = []
+
+    def failing_replace(src, dst):
+        calls.append(dst)
+        if len(calls) > 1:
+            raise OSError("disk full")
+        real_replace(src, dst)
+
+    monkeypatch.setattr(atomic_write.os, 'replace', failing_replace)
+    with pytest.raises(OSError):
+        batch.commit()
+    monkeypatch.setattr(atomic_write.os, 'replace', real_replace)
+
+    # 未发布的版本不留下临时文件和空的时间戳目录，下次运行以上一个完整版本为基准
+    assert _temp_files("backups") == []
+    assert not os.path.exists(os.path.dirname(new_startup))
+    assert backup_config.read_latest_backup(HOSTNAME, "startup", DEVICE) == (old_startup, "sysname A\r\n")
+    assert backup_config.save_config_to_file(HOSTNAME, "startup", "sysname A\r\n", DEVICE) == old_startup
+    assert backup_config.read_latest_backup(HOSTNAME, "running", DEVICE)[1] == "sysname B\r\n"
+    assert backup_config.read_latest_backup(HOSTNAME, "running", DEVICE)[0] != old_running
+
+def test_discard_removes_created_directories(tmp_path):
+    existing = tmp_path / "backups" / DEVICE
+    existing.mkdir(parents=True)
+    batch = WriteBatch()
+    batch.write_text(str(existing / "running" / "202601010000" / "a.txt"), "a")
+    batch.discard()
+
+    assert not (existing / "running").exists()
+    assert existing.is_dir()
+
+def test_clean_stale_temp_files(tmp_path):
+    version_dir = tmp_path / "backups" / DEVICE / "running" / "202601010000"
+    version_dir.mkdir(parents=True)
+    (version_dir / f".{HOSTNAME}_running.txt.tmp-123-0").write_text("partial")
+    published_dir = tmp_path / "backups" / DEVICE / "startup" / "202601010000"
+    published_dir.mkdir(parents=True)
+    (published_dir / f"{HOSTNAME}_startup.txt").write_text("sysname A")
+
+    # 未过期的临时文件可能属于正在运行的其他进程，不删除
+    assert clean_stale_temp_files(str(tmp_path / "backups")) == 0
+    assert clean_stale_temp_files(str(tmp_path / "backups"), max_age=-1) == 1
+    assert not version_dir.exists()
+    assert (published_dir / f"{HOSTNAME}_startup.txt").exists()
+
+def test_clean_command(tmp_path, monkeypatch):
+    """备份运行不再遍历backups/，由clean子命令清理崩溃遗留的临时文件"""
+    import cli
+
+    monkeypatch.chdir(tmp_path)
+    version_dir = tmp_path / "backups" / DEVICE / "running" / "202601010000"
+    version_dir.mkdir(parents=True)
+    temp_file = version_dir / f".{HOSTNAME}_running.txt.tmp-123-0"
+    temp_file.write_text("partial")
+    os.utime(temp_file, (0, 0))
+
+    cli.main(['clean'])
+    assert not version_dir.exists()
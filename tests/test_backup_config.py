@@ -0,0 +1,94 @@
+import os
+import time
+
+import backup_config
+
+RUNNING = "<sw1>display current-configuration\r\nsysname sw1\r\ninterface G1\r\n vlan 10\r\n<sw1>"
+STARTUP = "<sw1>display saved-configuration\r\nsysname sw1\r\ninterface G1\r\n<sw1>"
+DEVICE = {'hostname': '10.0.0.1', 'username': 'admin', 'password': 'pw', 'port': 22,
+          'device_type': 'huawei', 'device_name': 'sw1'}
+
+def _fake_get_config(hostname, username, password, port, command, *args, **kwargs):
+    return RUNNING if 'current' in command else STARTUP
+
+def test_process_device_compares_crlf_output_with_previous_backup(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(backup_config, 'get_config', _fake_get_config)
+
+    first = backup_config.process_device(DEVICE)
+    with open(first['running_config_file'], 'rb') as f:
+        assert f.read() == RUNNING.encode('utf-8')
+
+    # 设备输出为CRLF换行，上次备份必须按原始换行读取才能判定为未变化
+    second = backup_config.process_device(DEVICE)
+    assert second['status'] == 'success'
+    assert second['startup_changed'] is False
+    assert second['running_config_file'] == first['running_config_file']
+
+def test_spool_preserves_crlf(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    spool_file = backup_config.spool_config(RUNNING)
+    assert backup_config.load_spooled_config(spool_file) == RUNNING
+
+class FakeShell:
+    """按脚本回应命令的交互通道，responses为 {命令: [(延迟秒数, 输出片段)]}，其他输入回显后输出提示符"""
+    def __init__(self, responses):
+        self.responses = responses
+        self.pending = []  # (可读取的时间, 数据)
+
+    def settimeout(self, timeout):
+        pass
+
+    def send(self, data):
+        for line in data.split('\n')[:-1]:
+            command = line.strip()
+            ready_at = max([time.monotonic()] + [at for at, _ in self.pending])
+            for delay, text in self.responses.get(command, [(0, f"{command}\r\n<sw1>")]):
+                ready_at = max(ready_at, time.monotonic() + delay)
+                self.pending.append((ready_at, text.encode('utf-8')))
+
+    def recv_ready(self):
+        return bool(self.pending) and self.pending[0][0] <= time.monotonic()
+
+    def recv(self, size):
+        return self.pending.pop(0)[1]
+
+    def close(self):
+        pass
+
+class FakeClient:
+    def __init__(self, shell):
+        self.shell = shell
+
+    def invoke_shell(self):
+        return self.shell
+
+    def close(self):
+        pass
+
+def test_commands_in_one_session_sync_to_prompt(monkeypatch):
+    """华为配置中的#分隔行不是提示符，后半段配置到达较晚时也不能混入下一条命令的输出"""
+    real_sleep = time.sleep
+    monkeypatch.setattr(backup_config.time, 'sleep', lambda seconds: real_sleep(min(seconds, 0.05)))
+    running = backup_config.CONFIG_COMMANDS['running']
+    shell = FakeShell({running: [(0, f"{running}\r\n"), (0.1, "#\r\nsysname sw1\r\n#\r\n"),
+                                 (0.15, "interface G1\r\n#\r\nreturn\r\n<sw1>")]})
+    monkeypatch.setattr(backup_config, 'connect_device', lambda *args: FakeClient(shell))
+
+    outputs = backup_config.get_command_outputs('10.0.0.1', 'admin', 'pw', 22, [running, 'display version'],
+                                                device_type='huawei')
+
+    assert outputs[running].endswith("return\r\n<sw1>")
+    assert outputs['display version'] == "display version\r\n<sw1>"
+
+def test_summary_report_written_when_comparison_changed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    result = {'hostname': '10.0.0.1', 'device_name': 'sw1', 'status': 'success', 'has_diff': False,
+              'startup_changed': False, 'diff_changed': False, 'running_config_file': 'r.txt',
+              'startup_config_file': 's.txt', 'diff_file': None}
+    backup_config.write_summary_report([result])
+    assert not os.path.exists(os.path.join("backups", "reports"))
+
+    # 启动配置未变化，但比较结果与上次不同
+    backup_config.write_summary_report([dict(result, diff_changed=True)])
+    assert len(os.listdir(os.path.join("backups", "reports"))) == 1
@@ -0,0 +1,43 @@
+import os
+
+import config_blame
+from atomic_write import WriteBatch
+
+def _write(path, content):
+    with WriteBatch() as batch:
+        batch.write_text(path, content)
+    return path
+
+def _backup(timestamp, config, diff_timestamp=None):
+    """模拟一次备份结果，diff文件所在的时间戳目录可以与配置版本不同"""
+    running_file = _write(os.path.join("backups", "sw1", "running", timestamp, "10.0.0.1_running.txt"), config)
+    diff_file = None
+    if diff_timestamp:
+        diff_file = _write(os.path.join("backups", "sw1", "diff", diff_timestamp, "10.0.0.1_diff.txt"), "diff")
+    return {'hostname': '10.0.0.1', 'device_name': 'sw1', 'status': 'success',
+            'running_config_file': running_file, 'diff_file': diff_file}
+
+def test_blame_links_lines_to_recorded_diff_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    first = _backup("202601010000", "sysname sw1\ninterface G1\n")
+    config_blame.update_results_blame([first], backup_dir="backups")
+    # 备份跨越整分钟时diff目录的时间戳晚于配置版本
+    second = _backup("202601020000", "sysname sw1\ninterface G1\ninterface G2\n", diff_timestamp="202601020001")
+    config_blame.update_results_blame([second], backup_dir="backups")
+    # 同一分钟内另一个无关的diff文件不会被关联
+    _write(os.path.join("backups", "sw1", "diff", "202601010000", "10.0.0.1_diff.txt"), "other")
+
+    annotations = config_blame.blame("sw1", backup_dir="backups")
+    assert [(item['line'], item['version'], item['diff_file']) for item in annotations] == [
+        ('sysname sw1', '202601010000', None),
+        ('interface G1', '202601010000', None),
+        ('interface G2', '202601020000', second['diff_file']),
+    ]
+
+def test_unreferenced_diff_files_are_dropped(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config_blame.update_results_blame([_backup("202601010000", "a\n", diff_timestamp="202601010000")], "backups")
+    config_blame.update_results_blame([_backup("202601020000", "b\n", diff_timestamp="202601020000")], "backups")
+
+    cache = config_blame.load_blame_cache("sw1", backup_dir="backups")
+    assert list(cache['diff_files']) == ['202601020000']
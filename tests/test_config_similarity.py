@@ -0,0 +1,47 @@
+import numpy as np
+
+import config_similarity
+from config_similarity import SignatureStore, analyze_fleet, hash_lines, minhash
+
+def _hashes(lines):
+    return hash_lines(set(lines))
+
+def test_jaccard_with_empty_members():
+    consensus = _hashes(['a', 'b', 'c', 'd'])
+    line_hashes = [_hashes(['a', 'b', 'c', 'd']), _hashes([]), _hashes(['a', 'b']), _hashes([])]
+
+    # 空配置在中间和末尾时都不能取到其他设备的交集
+    similarities = config_similarity._jaccard(line_hashes, [0, 1, 2, 3], consensus)
+    assert np.allclose(similarities, [1.0, 0.0, 0.5, 0.0])
+    assert np.allclose(config_similarity._jaccard(line_hashes, [1, 3], consensus), [0.0, 0.0])
+
+def test_analyze_fleet_with_empty_config(tmp_path):
+    store = SignatureStore(str(tmp_path / "similarity.db"))
+    base = [f"interface GigabitEthernet0/0/{i}" for i in range(40)]
+    configs = {f"sw{i}": base for i in range(4)}
+    configs['sw9'] = []  # 只有提示符的备份，清理后为空
+    rows = []
+    for name, lines in configs.items():
+        config_file = tmp_path / f"{name}.txt"
+        config_file.write_text("\n".join(lines) + "\n", encoding='utf-8')
+        line_hashes = _hashes(lines)
+        rows.append((name, str(config_file), minhash(line_hashes), line_hashes))
+    store.save(rows)
+
+    analysis = analyze_fleet(refresh=False, store=store)
+    assert analysis['clusters'][0]['devices'] == ['sw0', 'sw1', 'sw2', 'sw3']
+    assert [(item['device_name'], item['similarity']) for item in analysis['outliers']] == [('sw9', 0.0)]
+    assert analysis['outliers'][0]['missing_count'] == 40
+
+def test_line_hashes_are_64bit_and_minhash_does_not_overflow():
+    lines = [f"interface GigabitEthernet0/0/{i}" for i in range(200)]
+    line_hashes = _hashes(lines)
+    assert line_hashes.dtype == np.uint64
+    assert len(line_hashes) == len(lines)
+    assert int(line_hashes.max()) >= 1 << 32
+
+    # 与按Python整数精确计算的结果一致，说明a*x+b没有在uint64中溢出
+    folded = [(int(h) ^ (int(h) >> 32)) & 0xFFFFFFFF for h in line_hashes]
+    expected = [min((int(a) * x + int(b)) % config_similarity.MERSENNE_PRIME for x in folded)
+                for a, b in zip(config_similarity._PERM_A, config_similarity._PERM_B)]
+    assert minhash(line_hashes).tolist() == expected
@@ -0,0 +1,194 @@
+"""
+跳板机共享连接测试：在进程内启动paramiko SSH服务作为跳板机和设备，
+验证所有设备会话共享一个跳板机Transport，且同时打开的通道数不超过max_channels
+"""
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+import pytest
+
+import backup_config
+import jump_host
+from ssh_pool import SSHSessionPool
+
+PASSWORD = 'secret'
+BASTION_USER = 'jump'
+_real_sleep = time.sleep
+
+class FakeSSHServer(paramiko.ServerInterface):
+    """同一个服务既作为跳板机（转发direct-tcpip通道）也作为设备（交互shell）"""
+    def __init__(self, transport, stats):
+        self.transport = transport
+        self.stats = stats
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if password != PASSWORD:
+            return paramiko.AUTH_FAILED
+        if username == BASTION_USER:
+            with self.stats['lock']:
+                self.stats['bastion_logins'] += 1
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        # 同一Transport上的消息按顺序处理，客户端先关闭的通道此时已从Transport中移除
+        with self.stats['lock']:
+            tunnels = self.stats['tunnels'].setdefault(id(self.transport), set())
+            tunnels.intersection_update(channel.chanid for channel in self.transport._channels.values())
+            tunnels.add(chanid)
+            self.stats['peak'] = max(self.stats['peak'], len(tunnels))
+            self.stats['forwards'][(id(self.transport), chanid)] = destination
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        threading.Thread(target=_run_shell, args=(channel,), daemon=True).start()
+        return True
+
+def _run_shell(channel):
+    """模拟设备命令行：回显每行输入，display命令返回一行输出，最后输出提示符"""
+    buffer = b""
+    while True:
+        data = channel.recv(1024)
+        if not data:
+            return
+        buffer += data
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            command = line.decode().strip()
+            if command.startswith('display'):
+                channel.send(f"{command}\r\noutput of {command}\r\n<sw>")
+            else:
+                channel.send(f"{command}\r\n<sw>")
+
+def _forward(channel, destination):
+    """跳板机转发：把direct-tcpip通道接到目标地址"""
+    sock = socket.create_connection(destination)
+
+    def pump(source, target):
+        try:
+            while True:
+                data = source.recv(32768)
+                if not data:
+                    break
+                target.sendall(data)
+            channel.close()
+        except (OSError, EOFError):
+            # 跳板机Transport已断开
+            pass
+        finally:
+            sock.close()
+
+    threads = [threading.Thread(target=pump, args=(channel, sock), daemon=True),
+               threading.Thread(target=pump, args=(sock, channel), daemon=True)]
+    for thread in threads:
+        thread.start()
+
+def _serve_connection(conn, host_key, stats):
+    transport = paramiko.Transport(conn)
+    transport.add_server_key(host_key)
+    server = FakeSSHServer(transport, stats)
+    try:
+        transport.start_server(server=server)
+    except (paramiko.SSHException, EOFError):
+        # 测试结束时客户端可能在协商完成前断开
+        return
+    while transport.is_active():
+        channel = transport.accept(0.5)
+        if channel is None:
+            continue
+        with stats['lock']:
+            destination = stats['forwards'].pop((id(transport), channel.get_id()), None)
+        if destination is not None:
+            threading.Thread(target=_forward, args=(channel, destination), daemon=True).start()
+
+@pytest.fixture(scope='module')
+def host_key():
+    return paramiko.RSAKey.generate(2048)
+
+@pytest.fixture
+def ssh_server(host_key):
+    """启动本地SSH服务，返回 (端口, 统计信息)"""
+    stats = {'lock': threading.Lock(), 'bastion_logins': 0, 'peak': 0, 'tunnels': {}, 'forwards': {}}
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+
+    def accept_loop():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=_serve_connection, args=(conn, host_key, stats), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    yield listener.getsockname()[1], stats
+    listener.close()
+
+@pytest.fixture
+def bastion(ssh_server, monkeypatch):
+    port, _ = ssh_server
+    bastion = jump_host.Bastion('jb', '127.0.0.1', BASTION_USER, PASSWORD, port=port, max_channels=2, slot_timeout=10)
+    monkeypatch.setattr(jump_host, '_bastions', {'jb': bastion})
+    # 缩短命令交互中的等待时间
+    monkeypatch.setattr(backup_config.time, 'sleep', lambda seconds: _real_sleep(min(seconds, 0.05)))
+    yield bastion
+    bastion.close()
+
+def _run(port, username, ssh_pool=None):
+    outputs = backup_config.get_command_outputs('127.0.0.1', username, PASSWORD, port, ['display version'],
+                                                device_type='huawei', ssh_pool=ssh_pool, via='jb')
+    return outputs['display version']
+
+def test_sessions_share_one_bastion_transport(ssh_server, bastion):
+    port, stats = ssh_server
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        outputs = list(executor.map(lambda i: _run(port, f"admin{i}"), range(5)))
+
+    assert all('output of display version' in output for output in outputs)
+    assert stats['bastion_logins'] == 1
+    assert 1 <= stats['peak'] <= 2
+
+def test_pool_reclaims_idle_sessions_on_same_bastion(ssh_server, bastion):
+    """连接池缓存的会话不会一直占用通道名额，超过max_channels个设备也能依次完成"""
+    port, stats = ssh_server
+    ssh_pool = SSHSessionPool(keepalive_interval=0)
+    try:
+        for i in range(3):
+            assert 'output of display version' in _run(port, f"admin{i}", ssh_pool)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            outputs = list(executor.map(lambda i: _run(port, f"admin{i}", ssh_pool), range(6)))
+        assert all('output of display version' in output for output in outputs)
+    finally:
+        ssh_pool.close_all()
+
+    assert stats['bastion_logins'] == 1
+    assert stats['peak'] <= 2
+
+def test_slot_wait_times_out(ssh_server, bastion):
+    port, _ = ssh_server
+    bastion.slot_timeout = 0.5
+    clients = [bastion.connect('127.0.0.1', f"admin{i}", PASSWORD, port) for i in range(2)]
+    try:
+        with pytest.raises(TimeoutError):
+            bastion.connect('127.0.0.1', 'admin2', PASSWORD, port)
+    finally:
+        for client in clients:
+            client.close()
+
+    # 名额归还后可以再次连接
+    bastion.connect('127.0.0.1', 'admin3', PASSWORD, port).close()
@@ -0,0 +1,85 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import backup_config
+import backup_daemon
+
+RUNNING = "<sw>display current-configuration\r\nsysname sw\r\ninterface G1\r\n vlan 10\r\n<sw>"
+STARTUP = "<sw>display saved-configuration\r\nsysname sw\r\ninterface G1\r\n<sw>"
+
+class BreakingPool(ThreadPoolExecutor):
+    """代替进程池：接受前两个任务后像子进程被终止的进程池一样拒绝提交"""
+    def __init__(self, max_workers=None, mp_context=None, initializer=None):
+        super().__init__(max_workers=max_workers, initializer=initializer)
+        self.submitted = 0
+        self._broken = False
+
+    def submit(self, *args, **kwargs):
+        if self.submitted >= 2:
+            self._broken = "A child process terminated abruptly"
+            raise BrokenProcessPool(self._broken)
+        self.submitted += 1
+        return super().submit(*args, **kwargs)
+
+def _fake_fetch(device, ssh_pool=None, capture_state=False):
+    return {'running_config': RUNNING, 'startup_config': STARTUP, 'error': None, 'startup_error': None,
+            'state': None}
+
+def test_broken_cpu_pool_does_not_hang(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(backup_config, 'fetch_device_configs', _fake_fetch)
+    monkeypatch.setattr(backup_config, 'ProcessPoolExecutor', BreakingPool)
+    devices = [{'hostname': f"10.0.0.{i}", 'device_name': f"sw{i}", 'device_type': 'huawei'} for i in range(30)]
+    outcome = {}
+
+    def run():
+        outcome['results'] = backup_config.run_backup_pipeline(devices, fetch_workers=4, cpu_workers=1,
+                                                               queue_size=2)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive(), "CPU进程池损坏后流水线没有结束"
+
+    statuses = [result['status'] for result in outcome['results']]
+    assert statuses.count('success') == 2
+    assert statuses.count('failed') == 28
+    # 未交给CPU阶段的配置不能留在暂存目录中
+    assert os.listdir(backup_config.SPOOL_DIR) == []
+
+def test_clean_stale_spool_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stale = backup_config.spool_config(RUNNING)
+    fresh = backup_config.spool_config(STARTUP)
+    os.utime(stale, (0, 0))
+
+    assert backup_config.clean_stale_spool_files() == 1
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+
+def test_cpu_pool_falls_back_to_spawn(monkeypatch):
+    assert backup_config.cpu_pool_context().get_start_method() == 'forkserver'
+    # Windows只支持spawn
+    monkeypatch.setattr(backup_config.multiprocessing, 'get_all_start_methods', lambda: ['spawn'])
+    assert backup_config.cpu_pool_context().get_start_method() == 'spawn'
+
+def test_daemon_reuses_cpu_pool_until_broken(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(backup_config, 'fetch_device_configs', _fake_fetch)
+    created = []
+    monkeypatch.setattr(backup_config, 'create_cpu_pool', lambda: created.append(BreakingPool(1)) or created[-1])
+    scheduler = backup_daemon.BackupScheduler(csv_file=str(tmp_path / "devices.csv"))
+    device = {'hostname': '10.0.0.1', 'device_name': 'sw1', 'device_type': 'huawei'}
+    try:
+        for _ in range(2):
+            assert scheduler.run_cycle([device])[0]['status'] == 'success'
+        assert len(created) == 1
+
+        # 第三个周期进程池损坏，下一周期重新创建
+        assert scheduler.run_cycle([device])[0]['status'] == 'failed'
+        assert scheduler.run_cycle([device])[0]['status'] == 'success'
+        assert len(created) == 2
+    finally:
+        scheduler.close()
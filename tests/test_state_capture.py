@@ -0,0 +1,39 @@
+import backup_config
+import state_capture
+
+INTERFACE_BRIEF = """<sw>display interface brief
+PHY: Physical
+*down: administratively down
+(l): loopback
+(s): spoofing
+(b): BFD down
+(e): ETHOAM down
+(d): Dampening Suppressed
+InUti/OutUti: input utility/output utility
+Interface                   PHY   Protocol InUti OutUti   inErrors  outErrors
+GigabitEthernet0/0/1        up    up          0%     0%          0          0
+GigabitEthernet0/0/2        down  down        0%     0%          0          0
+<sw>"""
+
+def test_process_device_captures_state_in_config_session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(state_capture, 'STATE_DB', str(tmp_path / "backups" / "state.db"))
+    sessions = []
+
+    def fake_outputs(hostname, username, password, port, commands, *args, **kwargs):
+        sessions.append(list(commands))
+        return {command: INTERFACE_BRIEF if 'interface' in command else f"<sw>{command}\nsysname sw1\n<sw>"
+                for command in commands}
+
+    monkeypatch.setattr(backup_config, 'get_command_outputs', fake_outputs)
+    device = {'hostname': '10.0.0.1', 'username': 'admin', 'password': 'pw', 'port': 22,
+              'device_type': 'huawei', 'device_name': 'sw1'}
+    result = backup_config.process_device(device, capture_state=True)
+
+    assert result['status'] == 'success'
+    # 运行配置和状态命令在同一个会话中执行，启动配置另用一个会话
+    assert sessions == [[backup_config.CONFIG_COMMANDS['running']] + state_capture.STATE_COMMANDS['huawei'][1],
+                        [backup_config.CONFIG_COMMANDS['startup']]]
+    columns, rows = state_capture.StateStore(state_capture.STATE_DB).query(
+        "SELECT device_name, interface, phy FROM latest_huawei_vrp_display_interface_brief ORDER BY interface")
+    assert rows == [('sw1', 'GigabitEthernet0/0/1', 'up'), ('sw1', 'GigabitEthernet0/0/2', 'down')]
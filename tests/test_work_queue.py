@@ -0,0 +1,107 @@
+import os
+import subprocess
+import sys
+import time
+
+import backup_config
+import work_queue
+from work_queue import WorkQueue
+
+DEVICES = [
+    {'hostname': '10.0.0.1', 'device_name': 'core', 'username': 'admin', 'password': 'pw', 'port': 22},
+    {'hostname': '10.0.0.2', 'device_name': 'core', 'username': 'admin', 'password': 'pw', 'port': 22},
+]
+
+# 在独立进程中运行worker，用假的process_device代替设备备份，结果中记录处理它的进程
+WORKER_SCRIPT = """
+import os, sys, time
+sys.path.insert(0, {repo!r})
+import backup_config, work_queue
+
+def fake_process_device(device, ssh_pool=None, capture_state=False):
+    time.sleep(0.05)
+    return {{'hostname': device['hostname'], 'device_name': device['device_name'], 'status': 'success',
+             'pid': os.getpid()}}
+
+backup_config.process_device = fake_process_device
+work_queue.POLL_SECONDS = 0.1
+sys.exit(work_queue.main(['--db', 'queue.db', 'worker', '--threads', '2']))
+"""
+
+def _mark_shared_root(run_id):
+    os.makedirs(work_queue.BACKUP_ROOT, exist_ok=True)
+    open(work_queue.run_marker(run_id), 'w').close()
+
+def _fake_process_device(processed):
+    def process_device(device, ssh_pool=None, capture_state=False):
+        processed.append(device['hostname'])
+        return {'hostname': device['hostname'], 'device_name': device['device_name'], 'status': 'success'}
+    return process_device
+
+def test_duplicate_device_names_are_separate_tasks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    run_id = queue.enqueue(DEVICES)
+    processed = []
+    monkeypatch.setattr(backup_config, 'process_device', _fake_process_device(processed))
+    _mark_shared_root(run_id)
+
+    assert work_queue.run_worker(queue, run_id) is True
+    assert processed == ['10.0.0.1', '10.0.0.2']
+    assert [result['hostname'] for result in queue.results(run_id)] == ['10.0.0.1', '10.0.0.2']
+
+def test_worker_refuses_without_shared_backup_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    run_id = queue.enqueue(DEVICES)
+
+    assert work_queue.run_worker(queue, run_id) is False
+    assert queue.progress(run_id) == {'pending': 2}
+
+def test_expired_lease_is_retried_by_another_worker(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(work_queue, 'POLL_SECONDS', 0.05)
+    queue = WorkQueue(str(tmp_path / "queue.db"), lease_seconds=0.2)
+    run_id = queue.enqueue(DEVICES[:1])
+    processed = []
+    monkeypatch.setattr(backup_config, 'process_device', _fake_process_device(processed))
+    _mark_shared_root(run_id)
+
+    # 第一个worker租用后退出，不提交结果也不续期
+    assert queue.lease(run_id, 'dead-worker') == (0, DEVICES[0])
+    assert work_queue.run_worker(queue, run_id) is True
+
+    assert processed == ['10.0.0.1']
+    assert queue.results(run_id)[0]['status'] == 'success'
+    # 原worker的租约已被接管，不能再提交结果
+    assert not queue.complete(run_id, 0, 'dead-worker', {'status': 'success'})
+
+def test_task_fails_after_max_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.db"), lease_seconds=0.05, max_attempts=work_queue.MAX_ATTEMPTS)
+    run_id = queue.enqueue(DEVICES[:1])
+
+    for attempt in range(work_queue.MAX_ATTEMPTS):
+        assert queue.lease(run_id, f"worker-{attempt}") is not None
+        time.sleep(0.1)
+
+    assert queue.lease(run_id, 'worker-last') is None
+    result, = queue.results(run_id)
+    assert result['status'] == 'failed'
+    assert str(work_queue.MAX_ATTEMPTS) in result['error']
+
+def test_worker_processes_share_the_queue(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    devices = [dict(DEVICES[0], hostname=f"10.0.1.{i}", device_name=f"sw{i}") for i in range(20)]
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    run_id = queue.enqueue(devices)
+    _mark_shared_root(run_id)
+
+    script = WORKER_SCRIPT.format(repo=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    workers = [subprocess.Popen([sys.executable, '-c', script], cwd=tmp_path, stdout=subprocess.DEVNULL)
+               for _ in range(3)]
+    assert [worker.wait(timeout=60) for worker in workers] == [0, 0, 0]
+
+    results = queue.results(run_id)
+    assert [result['hostname'] for result in results] == [device['hostname'] for device in devices]
+    assert all(result['status'] == 'success' for result in results)
+    assert len({result['pid'] for result in results}) > 1
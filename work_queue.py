@@ -0,0 +1,270 @@
+"""
+分布式备份：协调者把设备清单写入共享的SQLite任务队列，多个worker进程（可在不同主机上）租用设备执行备份
+  python work_queue.py coordinator [--db 队列文件]         入队devices.csv中的设备，等待全部完成后生成汇总报告
+  python work_queue.py worker [--region 区域] [--threads N] [--state] 租用并处理任务，没有可处理的设备后退出
+devices.csv的region列用于分区：指定--region的worker只处理该区域和未设置区域的设备
+租约在worker处理期间定期续期，worker异常退出后租约过期，设备会被其他worker重新处理
+备份、diff和溯源缓存都写入当前目录下的backups/，协调者和所有worker必须在同一个共享目录（如NFS挂载）中运行；
+协调者入队时在backups/下写入运行标记，看不到该标记的worker（使用的是本地backups/）拒绝处理
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import backup_config
+from atomic_write import WriteBatch
+
+DEFAULT_DB = os.path.join("backups", "work_queue.db")
+LEASE_SECONDS = 300  # 租约时长，处理期间每1/3租约时长续期一次
+MAX_ATTEMPTS = 3  # 同一设备最多被租用的次数，超过后记为失败
+POLL_SECONDS = 5
+BACKUP_ROOT = "backups"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    run_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    device_key TEXT NOT NULL,
+    region TEXT NOT NULL DEFAULT '',
+    device TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    PRIMARY KEY (run_id, seq)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (run_id, status, lease_expires);
+"""
+
+class WorkQueue:
+    """基于SQLite的设备任务队列，租用操作在IMMEDIATE事务中执行，可供多个进程并发访问"""
+    def __init__(self, db_file=DEFAULT_DB, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _Transaction(conn)
+
+    def enqueue(self, devices):
+        """创建一次运行并写入所有设备，返回run_id"""
+        run_id = time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        with self._connect() as conn:
+            conn.execute("INSERT INTO runs (run_id, created_at) VALUES (?, ?)", (run_id, time.time()))
+            conn.executemany(
+                "INSERT INTO tasks (run_id, seq, device_key, region, device) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, seq, device.get('device_name') or device['hostname'], device.get('region') or '',
+                  json.dumps(device, ensure_ascii=False)) for seq, device in enumerate(devices)]
+            )
+        return run_id
+
+    def latest_run(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT run_id FROM runs ORDER BY created_at DESC LIMIT 1").fetchone()
+        return row['run_id'] if row else None
+
+    def lease(self, run_id, owner, region=None):
+        """
+        租用一个待处理或租约已过期的设备，返回 (入队序号, 设备信息)，没有可租用的设备时返回None
+        超过最大租用次数的设备直接记为失败
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            while True:
+                row = conn.execute(
+                    "SELECT seq, device, attempts FROM tasks "
+                    "WHERE run_id = ? AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) "
+                    "AND (region = '' OR ? IS NULL OR region = ?) ORDER BY seq LIMIT 1",
+                    (run_id, now, region, region)
+                ).fetchone()
+                if row is None:
+                    return None
+
+                device = json.loads(row['device'])
+                if row['attempts'] >= self.max_attempts:
+                    result = backup_config.failed_result(device, f"超过最大重试次数({self.max_attempts})，租约多次过期")
+                    conn.execute("UPDATE tasks SET status = 'done', result = ?, lease_owner = NULL "
+                                 "WHERE run_id = ? AND seq = ?",
+                                 (json.dumps(result, ensure_ascii=False), run_id, row['seq']))
+                    continue
+
+                conn.execute("UPDATE tasks SET status = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                             "lease_expires = ? WHERE run_id = ? AND seq = ?",
+                             (owner, now + self.lease_seconds, run_id, row['seq']))
+                return row['seq'], device
+
+    def renew(self, run_id, seq, owner):
+        """续期租约，租约已被他人接管时返回False"""
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE tasks SET lease_expires = ? WHERE run_id = ? AND seq = ? "
+                                  "AND status = 'leased' AND lease_owner = ?",
+                                  (time.time() + self.lease_seconds, run_id, seq, owner))
+            return cursor.rowcount == 1
+
+    def complete(self, run_id, seq, owner, result):
+        """提交处理结果，只有仍持有租约的worker才能提交"""
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE tasks SET status = 'done', result = ?, lease_owner = NULL "
+                                  "WHERE run_id = ? AND seq = ? AND status = 'leased' AND lease_owner = ?",
+                                  (json.dumps(result, ensure_ascii=False), run_id, seq, owner))
+            return cursor.rowcount == 1
+
+    def progress(self, run_id, region=None):
+        """返回 {状态: 数量}，指定region时只统计该区域和未设置区域的设备"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM tasks WHERE run_id = ? "
+                                "AND (region = '' OR ? IS NULL OR region = ?) GROUP BY status",
+                                (run_id, region, region)).fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def results(self, run_id):
+        """按入队顺序返回所有已完成设备的结果"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT result FROM tasks WHERE run_id = ? AND status = 'done' ORDER BY seq",
+                                (run_id,)).fetchall()
+        return [json.loads(row['result']) for row in rows]
+
+class _Transaction:
+    """with语句结束时提交或回滚并关闭连接"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.conn.close()
+
+def process_leased_device(work_queue, run_id, seq, device, owner, capture_state=False):
+    """处理一个已租用的设备（seq为入队序号），处理期间在后台续期租约"""
+    device_key = device.get('device_name') or device['hostname']
+    stop = threading.Event()
+
+    def keep_lease():
+        while not stop.wait(work_queue.lease_seconds / 3):
+            if not work_queue.renew(run_id, seq, owner):
+                print(f"设备 {device_key} - 租约已被接管")
+                return
+
+    renewer = threading.Thread(target=keep_lease, daemon=True)
+    renewer.start()
+    try:
+        result = backup_config.process_device(device, capture_state=capture_state)
+    finally:
+        stop.set()
+        renewer.join()
+
+    if not work_queue.complete(run_id, seq, owner, result):
+        print(f"设备 {device_key} - 租约已过期，结果未提交")
+
+def run_marker(run_id):
+    """协调者在共享备份目录中写入的运行标记文件"""
+    return os.path.join(BACKUP_ROOT, f".queue-run-{run_id}")
+
+def run_worker(work_queue, run_id, region=None, threads=1, capture_state=False):
+    """
+    租用并处理任务，直到队列中没有可处理的设备；capture_state为True时同时采集设备运行状态
+    当前目录的backups/不是协调者的共享备份目录时不处理任何设备，返回False
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    if not os.path.exists(run_marker(run_id)):
+        print(f"当前目录下的 {BACKUP_ROOT}/ 中没有运行 {run_id} 的标记，不是协调者使用的共享备份目录，"
+              "请在共享目录中启动worker")
+        return False
+
+    def lease_loop(index):
+        worker_id = f"{owner}:{index}"
+        while True:
+            task = work_queue.lease(run_id, worker_id, region)
+            if task is not None:
+                process_leased_device(work_queue, run_id, *task, worker_id, capture_state)
+                continue
+            # 其他worker持有的租约可能过期，仍有租用中的设备时继续等待
+            if not work_queue.progress(run_id, region).get('leased'):
+                return
+            time.sleep(POLL_SECONDS)
+
+    pool = [threading.Thread(target=lease_loop, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    print(f"worker {owner} 已完成 (运行 {run_id})")
+    return True
+
+def run_coordinator(work_queue, csv_file='devices.csv'):
+    """入队设备，等待所有worker完成后生成汇总报告"""
+    devices = backup_config.load_devices_from_csv(csv_file)
+    if not devices:
+        print("没有找到设备信息，请检查设备列表或CSV文件")
+        return None
+
+    run_id = work_queue.enqueue(devices)
+    with WriteBatch() as batch:
+        batch.write_text(run_marker(run_id), f"{socket.gethostname()}:{os.getpid()}\n")
+    print(f"已入队 {len(devices)} 个设备，运行ID: {run_id}")
+
+    try:
+        while True:
+            progress = work_queue.progress(run_id)
+            done = progress.get('done', 0)
+            if done >= len(devices):
+                break
+            print(f"等待worker完成: {done}/{len(devices)}")
+            time.sleep(POLL_SECONDS)
+    finally:
+        os.remove(run_marker(run_id))
+
+    backup_config.write_summary_report(work_queue.results(run_id))
+    return run_id
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分布式配置备份")
+    parser.add_argument('--db', default=DEFAULT_DB, help="共享的SQLite队列文件")
+    parser.add_argument('--lease', type=int, default=LEASE_SECONDS, help="租约时长（秒）")
+    subparsers = parser.add_subparsers(dest='role', required=True)
+
+    coordinator_parser = subparsers.add_parser('coordinator', help="入队设备并汇总结果")
+    coordinator_parser.add_argument('--csv', default='devices.csv')
+
+    worker_parser = subparsers.add_parser('worker', help="租用并处理设备")
+    worker_parser.add_argument('--run', help="运行ID，默认最近一次运行")
+    worker_parser.add_argument('--region', help="只处理该区域（及未设置区域）的设备")
+    worker_parser.add_argument('--threads', type=int, default=1, help="并发处理的设备数")
+    worker_parser.add_argument('--state', action='store_true', help="备份时同时采集设备运行状态")
+
+    args = parser.parse_args(argv)
+    work_queue = WorkQueue(args.db, lease_seconds=args.lease)
+
+    if args.role == 'coordinator':
+        run_coordinator(work_queue, args.csv)
+    else:
+        run_id = args.run or work_queue.latest_run()
+        if run_id is None:
+            print("队列中没有运行")
+            return
+        if not run_worker(work_queue, run_id, args.region, args.threads, args.state):
+            return 1
+
+if __name__ == '__main__':
+    main()